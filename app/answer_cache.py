@@ -0,0 +1,107 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Semantischer Antwort-Cache auf Basis der Query-Embeddings.
+
+    Eine Antwort wird wiederverwendet, wenn die Kosinus-Ähnlichkeit zu einer
+    früheren Frage über dem Schwellwert liegt. Verdrängt wird nach LRU und TTL;
+    wird ein neuer FAISS-Index geladen, verwirft invalidate() alle Einträge.
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()  # key -> {embedding, question, answer, created}
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def invalidate(self):
+        """Verwirft alle Einträge, z. B. nachdem ein neuer Index geladen wurde"""
+        with self.lock:
+            if self.entries:
+                logger.info("Neuer Index geladen, Antwort-Cache wird geleert")
+                self.stats["invalidations"] += 1
+            self.entries.clear()
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self.entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        self.stats["expirations"] += len(expired)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding) -> Optional[str]:
+        """Gibt eine gecachte Antwort für eine ausreichend ähnliche Frage zurück"""
+        if self.max_size <= 0:
+            return None
+
+        vector = self._normalize(embedding)
+        with self.lock:
+            self._expire(time.time())
+            if not self.entries:
+                self.stats["misses"] += 1
+                return None
+
+            keys = list(self.entries.keys())
+            matrix = np.stack([self.entries[key]["embedding"] for key in keys])
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            key = keys[best]
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.entries[key]["answer"]
+
+    def store(self, embedding, question: str, answer: str):
+        """Legt eine neue Antwort ab und verdrängt bei Bedarf den ältesten Eintrag"""
+        if self.max_size <= 0 or not answer:
+            return
+
+        with self.lock:
+            self.entries[self.next_key] = {
+                "embedding": self._normalize(embedding),
+                "question": question,
+                "answer": answer,
+                "created": time.time(),
+            }
+            self.next_key += 1
+            self.stats["stores"] += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["max_size"] = self.max_size
+        stats["threshold"] = self.threshold
+        return stats
+
+
+# Singleton-Instanz
+answer_cache = AnswerCache()
@@ -0,0 +1,104 @@
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Wörter, Zahlen und zusammengesetzte Bezeichnungen wie OTC-Drug, SPF-30 oder 2.5oz als ein Token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its me my of on or our "
+    "that the their this to was we what when where which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Kleingeschriebene Tokens ohne Stoppwörter; zusammengesetzte Tokens zusätzlich in Teilen"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part and part not in STOPWORDS)
+    return tokens
+
+
+def build_bm25(texts: List[dict], k1: float = 1.2, b: float = 0.75) -> dict:
+    """Invertierter Index über die Textabschnitte (Term -> {Abschnitts-ID: Häufigkeit}), als JSON speicherbar"""
+    postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+    doc_lengths = {}
+    for position, entry in enumerate(texts):
+        chunk_id = str(entry.get("id", position))
+        tokens = tokenize(entry["text"])
+        doc_lengths[chunk_id] = len(tokens)
+        for term, count in Counter(tokens).items():
+            postings[term][chunk_id] = count
+    return {
+        "k1": k1,
+        "b": b,
+        "doc_lengths": doc_lengths,
+        "postings": postings,
+    }
+
+
+class BM25Index:
+    """BM25-Suche über einen mit build_bm25 erzeugten Index.
+
+    Der BM25-Beitrag eines Terms zu einem Abschnitt hängt nicht von der Anfrage ab und wird
+    beim Laden als Array (Positionen, Gewichte) pro Term vorberechnet; eine Suche addiert nur
+    noch die Arrays der Anfrage-Terme in einen Score-Vektor.
+    """
+
+    def __init__(self, data: dict):
+        k1, b = data["k1"], data["b"]
+        doc_lengths = data["doc_lengths"]
+        self.chunk_ids = np.asarray([int(chunk_id) for chunk_id in doc_lengths], dtype=np.int64)
+        positions = {chunk_id: position for position, chunk_id in enumerate(doc_lengths)}
+        self.size = len(doc_lengths)
+        avg_length = sum(doc_lengths.values()) / self.size if self.size else 0.0
+
+        # Term -> (Positionen der Abschnitte, Gewichte)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, docs in data["postings"].items():
+            idf = math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            weights = []
+            for chunk_id, count in docs.items():
+                norm = k1 * (1 - b + b * doc_lengths[chunk_id] / avg_length) if avg_length else k1
+                weights.append(idf * count * (k1 + 1) / (count + norm))
+            self.postings[term] = (
+                np.asarray([positions[chunk_id] for chunk_id in docs], dtype=np.int64),
+                np.asarray(weights, dtype=np.float32),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Gibt die k besten Abschnitts-IDs mit BM25-Score zurück, bester Treffer zuerst"""
+        matches = [self.postings[term] for term in set(tokenize(query)) if term in self.postings]
+        if not matches:
+            return []
+        scores = np.zeros(self.size, dtype=np.float32)
+        for positions, weights in matches:
+            # Jede Position kommt pro Term nur einmal vor
+            scores[positions] += weights
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(self.chunk_ids[p]), float(scores[p])) for p in candidates]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Führt Ranglisten über Reciprocal Rank Fusion zusammen: Score = Σ 1 / (k + Rang)"""
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,35 +1,119 @@
-from telegram import Update
+from telegram import Message, Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
+    CallbackQueryHandler,
     ContextTypes,
     MessageHandler,
     CommandHandler,
     filters
 )
 from fastapi import Request
-from .config import TELEGRAM_TOKEN, EMAIL_RECIPIENT
-from .llm import get_pipeline, generate_answer
-from .questionnaire import questionnaire_manager
+from fastapi.responses import JSONResponse
+from .config import (
+    TELEGRAM_TOKEN, EMAIL_RECIPIENT, STREAM_RESPONSES, STREAM_EDIT_INTERVAL, RETRIEVAL_CANDIDATES
+)
+from .answer_cache import answer_cache
+from .embeddings import query_encoder
+from .intents import intent_router
+from .retrieval import retriever
+from .llm import generate_answer_async, stream_answer, answer_budget, trim_answer
+from .prompt import prompt_builder
+from .questionnaire import questionnaire_manager, Question, CALLBACK_PREFIX
+from .startup import startup
+from .dispatcher import UpdateDispatcher
 
-import faiss, json
-from sentence_transformers import SentenceTransformer
+import asyncio
+import queue
 import logging
+import time
+from typing import Optional
 
 # Logger konfigurieren
 logger = logging.getLogger(__name__)
 
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-index = faiss.read_index("app/data/company.index")
-with open("app/data/company_texts.json","r",encoding="utf-8") as f:
-    TEXTS = json.load(f)
+# Embedder, Index und Modell werden beim Start parallel geladen (siehe main.lifespan)
+# Antworten aus dem Cache beziehen sich auf den alten Index
+retriever.add_reload_listener(lambda snapshot: answer_cache.invalidate())
 
 application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-llm = get_pipeline()
 
-def retrieve_context(query, k=3):
-    q_emb = embedder.encode([query])
-    D, I = index.search(q_emb, k)
-    return "\n\n".join(TEXTS[i]["text"] for i in I[0])
+async def embed_query(query):
+    return await query_encoder.encode_async(query)
+
+def retrieve_context(query, k=3, q_emb=None):
+    """Gibt die k passendsten Textabschnitte mit ihrem Score zurück (FAISS und BM25 fusioniert)"""
+    if q_emb is None:
+        q_emb = query_encoder.encode(query)
+    return retriever.search(q_emb, k, query=query)
+
+
+BUSY_MESSAGE = "I'm answering a lot of questions right now. Please try again in a moment."
+STARTING_MESSAGE = (
+    "I'm still starting up and can't answer questions yet. Please try again in a minute. "
+    "You can already fill in the product development questionnaire with /questionnaire."
+)
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+async def _edit_message(context: ContextTypes.DEFAULT_TYPE, message, text: str) -> float:
+    """Aktualisiert eine Nachricht; gibt zurück, wie lange vor dem nächsten Edit gewartet werden muss"""
+    try:
+        await context.bot.edit_message_text(
+            chat_id=message.chat_id,
+            message_id=message.message_id,
+            text=text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+        )
+    except RetryAfter as e:
+        # Telegram drosselt Edits; den Rest holt der nächste bzw. der finale Edit nach
+        retry_after = e.retry_after
+        return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    return 0.0
+
+
+async def reply_streaming(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                          prompt: str, max_new_tokens: int) -> Optional[str]:
+    """Sendet einen Platzhalter und füllt ihn gedrosselt mit den generierten Tokens.
+
+    Gibt die vollständige Antwort zurück oder None, wenn keine erzeugt wurde.
+    """
+    message = await update.message.reply_text("…")
+    raw_text, text, sent_text = "", "", ""
+    next_edit = time.monotonic() + STREAM_EDIT_INTERVAL
+
+    try:
+        async for chunk in stream_answer(prompt, max_new_tokens=max_new_tokens):
+            raw_text += chunk
+            # Stop-Strings und Text nach der Satzgrenze nicht anzeigen
+            text = trim_answer(raw_text)
+            if time.monotonic() >= next_edit and text and text != sent_text:
+                delay = await _edit_message(context, message, text)
+                if not delay:
+                    sent_text = text
+                next_edit = time.monotonic() + max(STREAM_EDIT_INTERVAL, delay)
+    except queue.Full:
+        await _edit_message(context, message, BUSY_MESSAGE)
+        return None
+
+    # Finaler Stand, notfalls nach Ablauf der Drosselung erneut versuchen
+    final_text = text.strip() or "Sorry, I could not generate an answer."
+    if final_text != sent_text:
+        delay = await _edit_message(context, message, final_text)
+        if delay:
+            await asyncio.sleep(delay)
+            await _edit_message(context, message, final_text)
+    return text.strip() or None
+
+
+async def reply_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, intent):
+    """Sendet die feste Antwort eines Intents und führt ggf. seine Aktion aus"""
+    user = update.effective_user
+    await update.message.reply_text(intent.render(first_name=user.first_name if user else ""))
+    if intent.action == "questionnaire":
+        await start_questionnaire(update, context)
 
 
 async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -39,41 +123,108 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Prüfe, ob ein Fragebogen aktiv ist
     if questionnaire_manager.is_questionnaire_active(chat_id):
         # Verarbeite die Antwort und hole die nächste Frage
-        next_question = questionnaire_manager.get_next_question(chat_id, user_text)
-        
-        if next_question:
-            # Wenn es eine weitere Frage gibt, sende sie
-            question_text = f"**{next_question.section}**\n{next_question.text}"
-            
-            # Wenn es Auswahlmöglichkeiten gibt, zeige sie an
-            if next_question.type == "choice" and next_question.options:
-                options_text = "\n".join([f"- {option}" for option in next_question.options])
-                question_text += f"\n\nOptions:\n{options_text}"
-                
-            await update.message.reply_text(question_text)
-            return
+        try:
+            next_question, error = await asyncio.to_thread(questionnaire_manager.submit_answer, chat_id, user_text)
+        except KeyError:
+            # Inzwischen abgeschlossen oder abgebrochen (z. B. von einem anderen Worker)
+            next_question = error = None
         else:
-            # Fragebogen ist abgeschlossen
-            completion_message = (
-                "Thank you for completing the questionnaire! Your responses have been saved.\n\n"
-                f"A PDF summary of your responses will be generated and sent to {EMAIL_RECIPIENT}.\n\n"
-                "You can now ask questions about Product Society."
-            )
-            await update.message.reply_text(completion_message)
+            await reply_questionnaire(update.message, next_question, error)
+            # Die Antwort ist keine Frage an den Chatbot
+            return
     
     # Normale Chat-Verarbeitung, wenn kein Fragebogen aktiv ist
-    context_snippet = retrieve_context(user_text, k=3)
-    prompt = (
-        "You are a company chatbot for Product Society. "
-        "Answer exclusively questions about Product Society using a professional, friendly, and detailed style!\n\n"
-        "### Relevant company texts:\n"
-        f"{context_snippet}\n\n"
-        "### Question:\n"
-        f"{user_text}\n\n"
-        "### Answer:"
+    q_emb, intent = None, None
+    if startup.is_ready("embedder", "intents"):
+        # Begrüßungen, Dank, Kontaktfragen usw. ohne Retrieval und LLM beantworten
+        q_emb = await embed_query(user_text)
+        intent, _ = intent_router.route(q_emb[0])
+        if intent is not None and intent.answer:
+            await reply_intent(update, context, intent)
+            return
+
+    if not startup.is_ready("embedder", "index", "model"):
+        await update.message.reply_text(STARTING_MESSAGE)
+        return
+
+    if q_emb is None:
+        q_emb = await embed_query(user_text)
+    cached_answer = answer_cache.lookup(q_emb[0])
+    if cached_answer:
+        await update.message.reply_text(cached_answer)
+        return
+
+    chunks = retrieve_context(user_text, k=RETRIEVAL_CANDIDATES, q_emb=q_emb)
+    prompt, _ = prompt_builder.build(user_text, chunks)
+    max_new_tokens = answer_budget(user_text, intent.max_new_tokens if intent is not None else None)
+    if STREAM_RESPONSES:
+        answer = await reply_streaming(update, context, prompt, max_new_tokens=max_new_tokens)
+    else:
+        try:
+            answer = await generate_answer_async(prompt, max_new_tokens=max_new_tokens)
+        except queue.Full:
+            await update.message.reply_text(BUSY_MESSAGE)
+            return
+        await update.message.reply_text(answer)
+
+    if answer:
+        answer_cache.store(q_emb[0], user_text, answer)
+
+
+async def send_question(message: Message, question: Question, error: Optional[str] = None):
+    """Sendet den vorbereiteten Fragetext, bei Auswahlfragen mit Buttons"""
+    text = f"{error}\n\n{question.message}" if error else question.message
+    await message.reply_text(text, reply_markup=question.keyboard)
+
+
+async def reply_questionnaire(message: Message, next_question: Optional[Question], error: Optional[str]):
+    """Antwortet auf eine Fragebogen-Antwort: nächste Frage, erneute Frage mit Fehler oder Abschluss"""
+    if next_question:
+        await send_question(message, next_question, error)
+        return
+    # Fragebogen ist abgeschlossen
+    completion_message = (
+        "Thank you for completing the questionnaire! Your responses have been saved.\n\n"
+        f"A PDF summary of your responses will be generated and sent to {EMAIL_RECIPIENT}.\n\n"
+        "You can now ask questions about Product Society."
     )
-    answer = generate_answer(prompt, max_new_tokens=256)
-    await update.message.reply_text(answer)
+    await message.reply_text(completion_message)
+
+
+async def option_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Antwort über einen Auswahl-Button (Callback-Daten q:<Frage-Index>:<Options-Index>)"""
+    query = update.callback_query
+    chat_id = update.effective_chat.id
+    try:
+        _, question_index, option_index = query.data.split(":")
+        question = questionnaire_manager.questions[int(question_index)]
+        option = question.options[int(option_index)]
+    except (ValueError, IndexError):
+        await query.answer()
+        return
+
+    if not questionnaire_manager.is_questionnaire_active(chat_id):
+        await query.answer("This questionnaire is no longer active.")
+        return
+    try:
+        next_question, error = await asyncio.to_thread(
+            questionnaire_manager.submit_answer, chat_id, option, int(question_index)
+        )
+    except KeyError:
+        await query.answer("This questionnaire is no longer active.")
+        return
+    if error:
+        # Veralteter Button: nur kurz anzeigen, die aktuelle Frage steht bereits im Chat
+        await query.answer(error)
+        return
+
+    await query.answer()
+    # Gewählte Option festhalten und die Buttons entfernen, damit nicht doppelt geantwortet wird
+    try:
+        await query.edit_message_text(f"{question.message}\n\n✅ {option}")
+    except BadRequest as e:
+        logger.debug(f"Frage konnte nicht aktualisiert werden: {e}")
+    await reply_questionnaire(query.message, next_question, None)
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -105,11 +256,8 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Abbrechen des Fragebogens"""
     chat_id = update.effective_chat.id
     
-    if questionnaire_manager.is_questionnaire_active(chat_id):
-        # Entferne die aktive Session
-        if chat_id in questionnaire_manager.active_sessions:
-            del questionnaire_manager.active_sessions[chat_id]
-        
+    # Entfernt die aktive Session und schreibt sie sofort (nicht auf dem Event-Loop)
+    if await asyncio.to_thread(questionnaire_manager.cancel_questionnaire, chat_id):
         await update.message.reply_text(
             "Questionnaire cancelled. You can restart it anytime with /questionnaire."
         )
@@ -124,33 +272,40 @@ async def start_questionnaire(update: Update, context: ContextTypes.DEFAULT_TYPE
     chat_id = update.effective_chat.id
     
     # Starte den Fragebogen
-    first_question = questionnaire_manager.start_questionnaire(chat_id)
+    first_question = await asyncio.to_thread(questionnaire_manager.start_questionnaire, chat_id)
     if first_question:
-        question_text = f"**{first_question.section}**\n{first_question.text}"
-        
-        # Wenn es Auswahlmöglichkeiten gibt, zeige sie an
-        if first_question.type == "choice" and first_question.options:
-            options_text = "\n".join([f"- {option}" for option in first_question.options])
-            question_text += f"\n\nOptions:\n{options_text}"
-            
-        await update.message.reply_text(question_text)
+        await send_question(update.message, first_question)
 
 
 # Handler registrieren
 application.add_handler(CommandHandler("start", start_command))
 application.add_handler(CommandHandler("questionnaire", questionnaire_command))
 application.add_handler(CommandHandler("cancel", cancel_command))
+application.add_handler(CallbackQueryHandler(option_callback, pattern=f"^{CALLBACK_PREFIX}"))
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, chat_handler))
 
-initialized = False
+async def process_update(update: Update):
+    # application.initialize() läuft im Startup; Updates warten ggf. darauf
+    if not await startup.wait_for("telegram"):
+        # Fehlgeschlagene Komponenten werden nicht erneut geladen (Fehler siehe /ready);
+        # der Dispatcher zählt das Update als fehlgeschlagen und protokolliert es
+        raise RuntimeError(f"Telegram-Application nicht initialisiert, Update {update.update_id} verworfen")
+    await application.process_update(update)
+
+dispatcher = UpdateDispatcher(process_update)
+
 
 async def handle_webhook(request: Request):
-    global initialized
-    if not initialized:
-        await application.initialize()
-        initialized = True
+    """Prüft das Update, reiht es ein und bestätigt sofort (ohne auf die Verarbeitung zu warten)"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"ok": False, "error": "invalid json"}, status_code=400)
+    if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+        return JSONResponse({"ok": False, "error": "invalid update"}, status_code=400)
 
-    data = await request.json()
     update = Update.de_json(data, application.bot)
-    await application.process_update(update)
-    return {"ok": True}
\ No newline at end of file
+    if not dispatcher.submit(update):
+        # Telegram stellt das Update später erneut zu
+        return JSONResponse({"ok": False, "error": "busy"}, status_code=503)
+    return {"ok": True}
@@ -5,9 +5,131 @@ HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_HUB_TOKEN")
 MODEL_NAME        = os.getenv("MODEL_NAME", "NousResearch/Meta-Llama-3.1-8B-Instruct")
 CACHE_DIR         = os.getenv("HF_CACHE_DIR", "/workspace/models")
 
+# Retrieval-Index (wird von scripts/build_index.py erzeugt)
+INDEX_PATH        = os.getenv("INDEX_PATH", "app/data/company.index")
+TEXTS_PATH        = os.getenv("TEXTS_PATH", "app/data/company_texts.json")
+INDEX_META_PATH   = os.getenv("INDEX_META_PATH", "app/data/company_index_meta.json")
+INDEX_MMAP        = os.getenv("INDEX_MMAP", "true").lower() in ("1", "true", "yes")
+# Überschreiben die beim Index-Bau ermittelten Suchparameter (leer = Wert aus INDEX_META_PATH)
+INDEX_NPROBE      = os.getenv("INDEX_NPROBE")
+INDEX_EF_SEARCH   = os.getenv("INDEX_EF_SEARCH")
+# Intervall (Sekunden), in dem auf einen neu gebauten Index geprüft wird; 0 = aus
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+# Hybride Suche: BM25 (Stichwörter, Produktnamen, SKUs) und FAISS per Reciprocal Rank Fusion
+BM25_PATH         = os.getenv("BM25_PATH", "app/data/company_bm25.json")
+RETRIEVAL_HYBRID  = os.getenv("RETRIEVAL_HYBRID", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_RRF_K   = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+# Kandidaten pro Verfahren vor der Fusion (mindestens k)
+RETRIEVAL_FUSION_DEPTH = int(os.getenv("RETRIEVAL_FUSION_DEPTH", "20"))
+
+# Prompt-Aufbau
+RETRIEVAL_CANDIDATES    = int(os.getenv("RETRIEVAL_CANDIDATES", "6"))
+PROMPT_CONTEXT_TOKENS   = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1024"))
+PROMPT_MIN_CHUNK_TOKENS = int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", "32"))
+PROMPT_DEDUPE_OVERLAP   = float(os.getenv("PROMPT_DEDUPE_OVERLAP", "0.8"))
+# Längere Nutzerfragen werden gekürzt, damit sie das Kontext-Budget nicht verdrängen
+PROMPT_QUESTION_TOKENS  = int(os.getenv("PROMPT_QUESTION_TOKENS", "256"))
+
+# Webhook-Warteschlange für eingehende Updates
+UPDATE_QUEUE_SIZE      = int(os.getenv("UPDATE_QUEUE_SIZE", "256"))
+UPDATE_WORKERS         = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_OVERFLOW_POLICY = os.getenv("UPDATE_OVERFLOW_POLICY", "reject")  # reject | drop_newest | drop_oldest
+# Maximal wartende Updates pro Chat, damit ein Chat die Warteschlange nicht füllt
+UPDATE_MAX_PER_CHAT    = int(os.getenv("UPDATE_MAX_PER_CHAT", "16"))
+# Anzahl gemerkter update_ids zum Erkennen von Telegram-Wiederholungen
+UPDATE_DEDUPE_SIZE     = int(os.getenv("UPDATE_DEDUPE_SIZE", "10000"))
+# sqlite: alle Worker-Prozesse teilen sich die gemerkten update_ids | memory: pro Prozess
+UPDATE_DEDUPE_BACKEND  = os.getenv("UPDATE_DEDUPE_BACKEND", "sqlite")
+UPDATE_DEDUPE_DB_PATH  = os.getenv("UPDATE_DEDUPE_DB_PATH", "app/data/updates.db")
+
+# Token für die /admin-Endpunkte (leer = deaktiviert)
+ADMIN_TOKEN       = os.getenv("ADMIN_TOKEN", "")
+
+# Query-Embeddings
+EMBEDDING_MODEL           = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_CACHE_SIZE      = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_MAX_BATCH_SIZE  = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WINDOW_MS = int(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+
 # E-Mail-Konfiguration
 EMAIL_SENDER      = os.getenv("EMAIL_SENDER", "bot@productsociety.com")
 EMAIL_PASSWORD    = os.getenv("EMAIL_PASSWORD", "")
 EMAIL_RECIPIENT   = os.getenv("EMAIL_RECIPIENT", "ps@society.de")
 SMTP_SERVER       = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-SMTP_PORT         = int(os.getenv("SMTP_PORT", "587"))
\ No newline at end of file
+SMTP_PORT         = int(os.getenv("SMTP_PORT", "587"))
+# Für einen lokalen Test-Server (z. B. aiosmtpd) SMTP_STARTTLS=false setzen
+SMTP_STARTTLS     = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_SSL          = os.getenv("SMTP_SSL", "false").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT      = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# PDF-Erstellung in einem Prozess-Pool (ReportLab läuft so nicht auf dem GIL des Webservers)
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))  # zugleich maximale Anzahl paralleler Renderings
+
+# E-Mail-Outbox: ausstehende Sendungen auf der Platte, ein Sender mit wiederverwendeter SMTP-Verbindung
+OUTBOX_DIR           = os.getenv("OUTBOX_DIR", "app/data/outbox")
+OUTBOX_MAX_ATTEMPTS  = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE    = float(os.getenv("OUTBOX_RETRY_BASE", "30"))    # Sekunden, verdoppelt sich pro Versuch
+OUTBOX_RETRY_MAX     = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+OUTBOX_IDLE_TIMEOUT  = float(os.getenv("OUTBOX_IDLE_TIMEOUT", "60"))  # SMTP-Verbindung danach schließen
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+
+# Fragebogen-Sessions
+SESSION_BACKEND        = os.getenv("SESSION_BACKEND", "sqlite")  # sqlite | memory
+SESSION_DB_PATH        = os.getenv("SESSION_DB_PATH", "app/data/sessions.db")
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+SESSION_CACHE_TTL      = float(os.getenv("SESSION_CACHE_TTL", "2"))
+
+# Abgeschlossene Fragebögen (SQLite, Group Commit)
+RESPONSES_DB_PATH          = os.getenv("RESPONSES_DB_PATH", "app/data/responses.db")
+RESPONSES_COMMIT_WINDOW_MS = int(os.getenv("RESPONSES_COMMIT_WINDOW_MS", "10"))
+# Danach übernimmt ein anderer Worker einen Fragebogen, dessen E-Mail nie in die Outbox kam
+RESPONSES_CLAIM_TIMEOUT    = float(os.getenv("RESPONSES_CLAIM_TIMEOUT", "600"))
+# Sekunden zwischen zwei Suchen nach solchen Fragebögen (0 = nur beim Start)
+RESPONSES_RESUME_INTERVAL  = float(os.getenv("RESPONSES_RESUME_INTERVAL", "300"))
+
+# Inferenz-Konfiguration
+LLM_WORKERS       = int(os.getenv("LLM_WORKERS", "1"))
+LLM_QUEUE_SIZE    = int(os.getenv("LLM_QUEUE_SIZE", "32"))
+LLM_MAX_BATCH_SIZE  = int(os.getenv("LLM_MAX_BATCH_SIZE", "8"))
+LLM_BATCH_WINDOW_MS = int(os.getenv("LLM_BATCH_WINDOW_MS", "20"))
+
+# Länge der Antworten: Token-Budgets und Abbruchkriterien
+LLM_MAX_NEW_TOKENS      = int(os.getenv("LLM_MAX_NEW_TOKENS", "256"))
+# Budget für kurze Faktenfragen ("Where is ...?", "What is your phone number?")
+LLM_SHORT_ANSWER_TOKENS = int(os.getenv("LLM_SHORT_ANSWER_TOKENS", "96"))
+LLM_SHORT_QUESTION_WORDS = int(os.getenv("LLM_SHORT_QUESTION_WORDS", "8"))
+# Generierung endet bei einem dieser Strings (durch | getrennt, \n für Zeilenumbrüche) ...
+LLM_STOP_STRINGS        = [s.replace("\\n", "\n") for s in os.getenv("LLM_STOP_STRINGS", "###").split("|") if s]
+# ... oder nach so vielen Sätzen (0 = keine Begrenzung)
+LLM_MAX_SENTENCES       = int(os.getenv("LLM_MAX_SENTENCES", "0"))
+
+# Inferenz-Backend: Gerät und Quantisierung der Gewichte
+# LLM_DEVICE: auto | cuda | cpu; auf CPU wird ohne Quantisierung in float32 gerechnet
+LLM_DEVICE        = os.getenv("LLM_DEVICE", "auto").lower()
+# LLM_QUANTIZATION: none | int8-dynamic (nur CPU) | bnb-8bit | bnb-4bit (bitsandbytes)
+LLM_QUANTIZATION  = os.getenv("LLM_QUANTIZATION", "none").lower()
+LLM_CPU_THREADS   = int(os.getenv("LLM_CPU_THREADS", "0"))  # 0 = Standard von torch
+
+# Gemeinsamer Modell-Server (python -m app.model_server); leer = Modell im eigenen Prozess.
+# Unix-Socket-Pfad (/tmp/ps_chatbot_model.sock) oder host:port
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+# Pflicht, sobald MODEL_SERVER_ADDRESS gesetzt ist: über die Verbindung laufen gepickelte Objekte,
+# wer den Schlüssel kennt, kann auf dem Modell-Server Code ausführen
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "")
+# TCP-Adressen außerhalb von localhost nur nach ausdrücklicher Freigabe
+MODEL_SERVER_ALLOW_REMOTE = os.getenv("MODEL_SERVER_ALLOW_REMOTE", "false").lower() in ("1", "true", "yes")
+# So lange warten Worker beim Start auf den Modell-Server (der Socket öffnet erst nach dem Laden des Modells)
+MODEL_SERVER_CONNECT_TIMEOUT = float(os.getenv("MODEL_SERVER_CONNECT_TIMEOUT", "1800"))
+
+# Streaming der Antworten über Nachrichten-Updates
+STREAM_RESPONSES      = os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL  = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Intent-Router: häufige Nachrichten (Begrüßung, Dank, Kontakt, ...) ohne LLM beantworten
+INTENTS_PATH      = os.getenv("INTENTS_PATH", "app/data/intents.json")
+INTENT_THRESHOLD  = float(os.getenv("INTENT_THRESHOLD", "0.75"))  # minimale Kosinus-Ähnlichkeit zu einem Beispiel
+
+# Semantischer Antwort-Cache
+ANSWER_CACHE_SIZE      = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL       = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
@@ -0,0 +1,301 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from .config import (
+    UPDATE_QUEUE_SIZE, UPDATE_WORKERS, UPDATE_OVERFLOW_POLICY, UPDATE_DEDUPE_SIZE, UPDATE_MAX_PER_CHAT,
+    UPDATE_DEDUPE_BACKEND, UPDATE_DEDUPE_DB_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("reject", "drop_newest", "drop_oldest")
+
+
+class SeenUpdates:
+    """Merkt sich die zuletzt angenommenen update_ids (Ringpuffer + Set für O(1)-Lookups)"""
+
+    def __init__(self, capacity: int = UPDATE_DEDUPE_SIZE):
+        self.capacity = max(1, capacity)
+        self.order = deque()
+        self.ids = set()
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self.ids
+
+    def claim(self, update_id: int) -> bool:
+        """Merkt sich die update_id; False, wenn sie schon bekannt war"""
+        if update_id in self.ids:
+            return False
+        if len(self.order) >= self.capacity:
+            self.ids.discard(self.order.popleft())
+        self.order.append(update_id)
+        self.ids.add(update_id)
+        return True
+
+    def release(self, update_id: int):
+        """Vergisst eine update_id wieder (abgelehntes Update, Telegram stellt es erneut zu)"""
+        if update_id in self.ids:
+            self.ids.discard(update_id)
+            self.order.remove(update_id)
+
+    def close(self):
+        pass
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+
+class SQLiteSeenUpdates:
+    """Gemerkte update_ids in SQLite, geteilt von allen Worker-Prozessen.
+
+    Telegram kann ein Update erneut an einen anderen Worker zustellen; claim() trägt die
+    update_id per INSERT OR IGNORE ein, sodass genau ein Worker das Update verarbeitet.
+    Ältere Einträge jenseits der Kapazität werden gelegentlich gelöscht. claim() wartet bei
+    gesperrter Datenbank bis zu busy_timeout und läuft daher in einem Thread, nicht im Webhook.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str = UPDATE_DEDUPE_DB_PATH, capacity: int = UPDATE_DEDUPE_SIZE):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self.capacity = max(1, capacity)
+        self.claims = 0
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+        self.conn.commit()
+
+    def __contains__(self, update_id: int) -> bool:
+        with self.db_lock:
+            return self.conn.execute(
+                "SELECT 1 FROM seen_updates WHERE update_id = ?", (update_id,)
+            ).fetchone() is not None
+
+    def claim(self, update_id: int) -> bool:
+        with self.db_lock, self.conn:
+            claimed = self.conn.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, time.time())
+            ).rowcount == 1
+            self.claims += 1
+            if self.claims % self.PRUNE_EVERY == 0:
+                self.conn.execute(
+                    "DELETE FROM seen_updates WHERE update_id NOT IN "
+                    "(SELECT update_id FROM seen_updates ORDER BY seen_at DESC LIMIT ?)", (self.capacity,)
+                )
+        return claimed
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+    def __len__(self) -> int:
+        with self.db_lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen_updates").fetchone()[0]
+
+
+def create_shared_seen_updates() -> Optional[SQLiteSeenUpdates]:
+    """Erzeugt die prozessübergreifende Dedupe (UPDATE_DEDUPE_BACKEND=sqlite); None bei memory"""
+    if UPDATE_DEDUPE_BACKEND == "memory":
+        return None
+    if UPDATE_DEDUPE_BACKEND != "sqlite":
+        raise ValueError(f"Unbekanntes Dedupe-Backend '{UPDATE_DEDUPE_BACKEND}' (erlaubt: sqlite, memory)")
+    return SQLiteSeenUpdates()
+
+
+def chat_key(update):
+    """Schlüssel der Lane, in der ein Update verarbeitet wird (pro Chat seriell)"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    # Updates ohne Chat/Nutzer haben keine Reihenfolge einzuhalten
+    return ("update", update.update_id)
+
+
+class UpdateDispatcher:
+    """Nimmt Telegram-Updates entgegen und verarbeitet sie aus einer begrenzten Warteschlange.
+
+    Der Webhook kann so sofort antworten; ist die Warteschlange voll, entscheidet
+    die Overflow-Policy: "reject" (Telegram stellt später erneut zu),
+    "drop_newest" (neues Update verwerfen) oder "drop_oldest" (ältestes verwerfen).
+    Von Telegram erneut zugestellte Updates (gleiche update_id) werden verworfen: im Webhook
+    anhand der update_ids dieses Prozesses, vor der Verarbeitung zusätzlich über die
+    geteilte SQLite-Tabelle, falls ein anderer Worker das Update schon angenommen hat.
+
+    Updates eines Chats landen in einer eigenen Lane und werden streng
+    nacheinander verarbeitet, verschiedene Chats parallel. Die Lanes kommen
+    reihum dran (ein Update pro Runde), und jede Lane ist zusätzlich begrenzt,
+    damit ein einzelner Chat weder die Consumer noch das LLM blockiert.
+    """
+
+    def __init__(self, process: Callable[[object], Awaitable[None]], queue_size: int = UPDATE_QUEUE_SIZE,
+                 num_workers: int = UPDATE_WORKERS, overflow_policy: str = UPDATE_OVERFLOW_POLICY,
+                 max_per_chat: int = UPDATE_MAX_PER_CHAT):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unbekannte Overflow-Policy '{overflow_policy}' (erlaubt: {', '.join(OVERFLOW_POLICIES)})")
+        if queue_size < 1:
+            raise ValueError(f"UPDATE_QUEUE_SIZE muss mindestens 1 sein (ist {queue_size})")
+        self.process = process
+        self.queue_size = queue_size
+        self.num_workers = max(1, num_workers)
+        self.overflow_policy = overflow_policy
+        self.max_per_chat = max(1, max_per_chat)
+        self.lanes: Dict[Hashable, deque] = {}  # Chat -> wartende (update, enqueued_at)
+        self.ready = None  # Lanes mit Arbeit, die gerade niemand verarbeitet (Round-Robin)
+        self.pending = 0
+        self.workers: List[asyncio.Task] = []
+        self.seen = SeenUpdates()
+        self.shared_seen = create_shared_seen_updates()
+        self.stats = {
+            "accepted": 0,
+            "duplicates": 0,
+            "processed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "dropped_newest": 0,
+            "dropped_oldest": 0,
+            "max_queue_depth": 0,
+            "max_lane_depth": 0,
+            "total_wait_seconds": 0.0,
+            "total_process_seconds": 0.0,
+        }
+
+    def start(self):
+        """Startet die Consumer-Tasks im laufenden Event-Loop"""
+        if self.workers:
+            return
+        self.ready = asyncio.Queue()
+        self.workers = [
+            asyncio.create_task(self._consume(), name=f"update-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.shared_seen is not None:
+            self.shared_seen.close()
+
+    def _drop_oldest(self, lane: deque = None) -> bool:
+        """Verwirft das älteste wartende Update (einer Lane oder insgesamt); False, wenn keins wartet"""
+        if lane is None:
+            lane = min((l for l in self.lanes.values() if l), key=lambda l: l[0][1], default=None)
+        if not lane:
+            return False
+        lane.popleft()
+        self.pending -= 1
+        self.stats["dropped_oldest"] += 1
+        logger.warning("Update-Warteschlange voll, ältestes Update verworfen")
+        return True
+
+    def submit(self, update) -> bool:
+        """Reiht ein Update ein; gibt False zurück, wenn es abgelehnt wurde"""
+        # Nur im Speicher, damit der Webhook sofort antwortet; die geteilte Dedupe folgt im Consumer
+        if not self.seen.claim(update.update_id):
+            self.stats["duplicates"] += 1
+            logger.info(f"Update {update.update_id} bereits erhalten, wird ignoriert")
+            return True
+
+        key = chat_key(update)
+        lane = self.lanes.get(key)
+        lane_full = lane is not None and len(lane) >= self.max_per_chat
+        if lane_full or self.pending >= self.queue_size:
+            if self.overflow_policy == "reject" or (
+                self.overflow_policy == "drop_oldest" and not self._drop_oldest(lane if lane_full else None)
+            ):
+                # Abgelehnte Updates sollen erneut kommen dürfen
+                self.seen.release(update.update_id)
+                self.stats["rejected"] += 1
+                logger.warning(f"Update-Warteschlange voll (Chat {key}), Update abgelehnt")
+                return False
+            if self.overflow_policy == "drop_newest":
+                self.stats["dropped_newest"] += 1
+                logger.warning(f"Update-Warteschlange voll (Chat {key}), neues Update verworfen")
+                return True
+
+        if lane is None:
+            lane = self.lanes[key] = deque()
+            # Neue Lane: ans Ende der Runde; bestehende Lanes sind schon eingereiht oder aktiv
+            self.ready.put_nowait(key)
+        lane.append((update, time.monotonic()))
+        self.pending += 1
+
+        self.stats["accepted"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.pending)
+        self.stats["max_lane_depth"] = max(self.stats["max_lane_depth"], len(lane))
+        return True
+
+    async def _consume(self):
+        while True:
+            key = await self.ready.get()
+            lane = self.lanes[key]
+            if not lane:
+                # Alle Updates der Lane wurden per drop_oldest verworfen
+                del self.lanes[key]
+                continue
+
+            update, enqueued_at = lane.popleft()
+            self.pending -= 1
+            if not await self._claim_shared(update):
+                self._requeue(key, lane)
+                continue
+
+            started = time.monotonic()
+            self.stats["total_wait_seconds"] += started - enqueued_at
+            try:
+                await self.process(update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Fehler bei der Verarbeitung eines Updates: {e}")
+            finally:
+                self.stats["total_process_seconds"] += time.monotonic() - started
+                self._requeue(key, lane)
+
+    async def _claim_shared(self, update) -> bool:
+        """Beansprucht das Update in der geteilten Dedupe; False, wenn ein anderer Worker es hat"""
+        if self.shared_seen is None:
+            return True
+        try:
+            claimed = await asyncio.to_thread(self.shared_seen.claim, update.update_id)
+        except sqlite3.Error as e:
+            # Lieber doppelt verarbeiten als ein Update verlieren
+            logger.error(f"Geteilte Dedupe für Update {update.update_id} nicht erreichbar: {e}")
+            return True
+        if not claimed:
+            self.stats["duplicates"] += 1
+            logger.info(f"Update {update.update_id} bereits von einem anderen Worker angenommen, wird ignoriert")
+        return claimed
+
+    def _requeue(self, key, lane: deque):
+        # Ein Update pro Runde: die Lane stellt sich wieder hinten an
+        if lane:
+            self.ready.put_nowait(key)
+        else:
+            del self.lanes[key]
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        finished = stats["processed"] + stats["failed"]
+        stats["queue_depth"] = self.pending
+        stats["queue_size"] = self.queue_size
+        stats["lanes"] = len(self.lanes)
+        stats["max_per_chat"] = self.max_per_chat
+        stats["workers"] = self.num_workers
+        stats["overflow_policy"] = self.overflow_policy
+        stats["seen_update_ids"] = len(self.seen)
+        stats["shared_dedupe"] = self.shared_seen is not None
+        stats["avg_wait_seconds"] = stats["total_wait_seconds"] / finished if finished else 0.0
+        stats["avg_process_seconds"] = stats["total_process_seconds"] / finished if finished else 0.0
+        return stats
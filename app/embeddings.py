@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+import logging
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from .config import (
+    EMBEDDING_MODEL, EMBEDDING_CACHE_SIZE,
+    EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEncoder:
+    """Kodiert Suchanfragen mit LRU-Cache und bündelt gleichzeitige Anfragen.
+
+    Schlüssel des Caches ist der normalisierte Text (Kleinschreibung, einfache
+    Leerzeichen). Das Modell ist ohnehin uncased, die Embeddings bleiben also gleich.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, cache_size: int = EMBEDDING_CACHE_SIZE,
+                 max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE, batch_window_ms: int = EMBEDDING_BATCH_WINDOW_MS):
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = max(0, batch_window_ms) / 1000
+        self.embedder = None
+        self.cache = OrderedDict()  # normalisierter Text -> Embedding
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.batch: List[str] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "encode_calls": 0, "encoded_texts": 0, "encode_seconds": 0.0}
+
+    def load(self) -> SentenceTransformer:
+        """Lädt den Sentence-Transformer (nur beim ersten Aufruf)"""
+        with self.lock:
+            if self.embedder is None:
+                self.embedder = SentenceTransformer(self.model_name)
+        return self.embedder
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        with self.lock:
+            embedding = self.cache.get(key)
+            if embedding is None:
+                self.stats["misses"] += 1
+                return None
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return embedding
+
+    def _cache_put(self, key: str, embedding: np.ndarray):
+        if self.cache_size <= 0:
+            return
+        with self.lock:
+            self.cache[key] = embedding
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        embedder = self.load()
+        started = time.monotonic()
+        embeddings = np.asarray(embedder.encode(texts), dtype=np.float32)
+        with self.lock:
+            self.stats["encode_calls"] += 1
+            self.stats["encoded_texts"] += len(texts)
+            self.stats["encode_seconds"] += time.monotonic() - started
+            self.batch_sizes[len(texts)] += 1
+        return embeddings
+
+    def encode(self, text: str) -> np.ndarray:
+        """Synchrones Kodieren einer einzelnen Anfrage; Ergebnis hat die Form (1, dim)"""
+        key = self.normalize(text)
+        embedding = self._cache_get(key)
+        if embedding is None:
+            embedding = self._encode([key])[0]
+            self._cache_put(key, embedding)
+        return embedding.reshape(1, -1)
+
+    async def encode_async(self, text: str) -> np.ndarray:
+        """Kodiert eine Anfrage, ohne den Event-Loop zu blockieren.
+
+        Gleichzeitige Anfragen innerhalb des Batch-Fensters werden in einem
+        einzigen encode-Aufruf zusammengefasst, identische nur einmal kodiert.
+        """
+        key = self.normalize(text)
+        embedding = self._cache_get(key)
+        if embedding is not None:
+            return embedding.reshape(1, -1)
+
+        if key in self.pending:
+            self.stats["coalesced"] += 1
+            embedding = await asyncio.shield(self.pending[key])
+            return embedding.reshape(1, -1)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[key] = future
+        self.batch.append(key)
+
+        if len(self.batch) >= self.max_batch_size:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.batch_window, self._flush)
+
+        embedding = await asyncio.shield(future)
+        return embedding.reshape(1, -1)
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.batch = self.batch, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[str]):
+        try:
+            embeddings = await asyncio.to_thread(self._encode, batch)
+        except Exception as e:
+            logger.error(f"Fehler beim Kodieren von {len(batch)} Anfragen: {e}")
+            for key in batch:
+                future = self.pending.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, embedding in zip(batch, embeddings):
+            self._cache_put(key, embedding)
+            future = self.pending.pop(key)
+            if not future.done():
+                future.set_result(embedding)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["batch_sizes"] = dict(sorted(self.batch_sizes.items()))
+            stats["cache_size"] = len(self.cache)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["avg_encode_ms"] = (
+            stats["encode_seconds"] / stats["encode_calls"] * 1000 if stats["encode_calls"] else 0.0
+        )
+        return stats
+
+
+# Singleton-Instanz
+query_encoder = QueryEncoder()
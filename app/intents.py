@@ -0,0 +1,128 @@
+import json
+import re
+import threading
+import logging
+from collections import Counter
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .config import INTENTS_PATH, INTENT_THRESHOLD
+from .embeddings import query_encoder
+
+logger = logging.getLogger(__name__)
+
+
+class Intent:
+    """Ein Intent mit Beispielsätzen und fester (bzw. per format_map befüllter) Antwort.
+
+    Intents ohne Antwort gehen weiter an RAG und LLM, geben aber ihr eigenes
+    Token-Budget (max_new_tokens) vor.
+    """
+
+    def __init__(self, name: str, examples: list, answer: Optional[str] = None,
+                 action: Optional[str] = None, threshold: Optional[float] = None,
+                 max_new_tokens: Optional[int] = None):
+        self.name = name
+        self.examples = examples
+        self.answer = answer
+        self.action = action
+        self.threshold = threshold
+        self.max_new_tokens = max_new_tokens
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Intent":
+        return cls(
+            name=data["name"],
+            examples=data["examples"],
+            answer=data.get("answer"),
+            action=data.get("action"),
+            threshold=data.get("threshold"),
+            max_new_tokens=data.get("max_new_tokens"),
+        )
+
+    def render(self, **variables) -> str:
+        """Setzt Platzhalter wie {first_name} ein; unbekannte bleiben leer"""
+        text = self.answer.format_map(_DefaultDict(variables))
+        # "Hello !" bei leerem Platzhalter vermeiden
+        return re.sub(r"\s+([!?.,])", r"\1", text)
+
+
+class _DefaultDict(dict):
+    def __missing__(self, key):
+        return ""
+
+
+class IntentRouter:
+    """Erste, günstige Stufe vor RAG und LLM.
+
+    Die Beispielsätze aller Intents werden einmalig mit demselben MiniLM-Modell
+    wie die Suchanfragen kodiert. Liegt die Kosinus-Ähnlichkeit einer Nachricht
+    zum nächsten Beispiel über dem Schwellwert, wird die Antwort des Intents
+    verwendet; sonst geht die Nachricht an Retrieval und LLM weiter.
+    """
+
+    def __init__(self, path: str = INTENTS_PATH, threshold: float = INTENT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.intents = []
+        self.example_intents = None  # Index des Intents pro Beispielzeile
+        self.matrix = None  # normalisierte Embeddings der Beispiele
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.stats = {"routed": 0, "budgeted": 0, "fallthrough": 0}
+
+    def load(self):
+        """Lädt die Intents und kodiert ihre Beispiele (nur beim ersten Aufruf)"""
+        with self.lock:
+            if self.matrix is not None:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                intents = [Intent.from_dict(item) for item in json.load(f)["intents"]]
+
+            examples = [query_encoder.normalize(e) for intent in intents for e in intent.examples]
+            embeddings = np.asarray(query_encoder.load().encode(examples), dtype=np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+            self.intents = intents
+            self.example_intents = np.array([i for i, intent in enumerate(intents) for _ in intent.examples])
+            self.matrix = embeddings
+            logger.info(f"{len(intents)} Intents mit {len(examples)} Beispielen geladen")
+
+    def route(self, embedding) -> Tuple[Optional[Intent], float]:
+        """Gibt den passenden Intent (oder None) und die beste Ähnlichkeit zurück"""
+        if self.matrix is None:
+            return None, 0.0
+
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        similarities = self.matrix @ vector
+        best = int(np.argmax(similarities))
+        score = float(similarities[best])
+        intent = self.intents[self.example_intents[best]]
+
+        threshold = intent.threshold if intent.threshold is not None else self.threshold
+        with self.lock:
+            if score < threshold:
+                self.stats["fallthrough"] += 1
+                return None, score
+            # "routed" zählt nur Antworten ohne LLM, "budgeted" Intents, die nur das Budget vorgeben
+            self.stats["routed" if intent.answer else "budgeted"] += 1
+            self.hits[intent.name] += 1
+        return intent, score
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["hits"] = dict(self.hits.most_common())
+        total = stats["routed"] + stats["budgeted"] + stats["fallthrough"]
+        stats["hit_rate"] = stats["routed"] / total if total else 0.0
+        stats["intents"] = len(self.intents)
+        stats["threshold"] = self.threshold
+        return stats
+
+
+# Singleton-Instanz
+intent_router = IntentRouter()
@@ -1,53 +1,400 @@
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
+    StoppingCriteria,
+    StoppingCriteriaList,
     pipeline
 )
-from .config import MODEL_NAME, CACHE_DIR, HUGGINGFACE_TOKEN
-import os, torch
+from transformers.generation.streamers import BaseStreamer
+from .config import (
+    MODEL_NAME, CACHE_DIR, HUGGINGFACE_TOKEN,
+    LLM_WORKERS, LLM_QUEUE_SIZE, LLM_MAX_BATCH_SIZE, LLM_BATCH_WINDOW_MS, MODEL_SERVER_ADDRESS,
+    LLM_DEVICE, LLM_QUANTIZATION, LLM_CPU_THREADS,
+    LLM_MAX_NEW_TOKENS, LLM_SHORT_ANSWER_TOKENS, LLM_SHORT_QUESTION_WORDS, LLM_STOP_STRINGS, LLM_MAX_SENTENCES
+)
+import os, re, torch
+import copy
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from typing import AsyncIterator, Callable, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
 
 
 tokenizer, model, pipe = None, None, None
 
+# Fester Anfang jedes Chat-Prompts; sein KV-Cache wird einmalig vorberechnet
+SYSTEM_PROMPT = (
+    "You are a company chatbot for Product Society. "
+    "Answer exclusively questions about Product Society using a professional, friendly, and detailed style!\n\n"
+)
+prefix_ids, prefix_cache = None, None
+_init_lock = threading.Lock()
+prefix_cache_stats = {"hits": 0, "misses": 0}
+
+QUANTIZATION_MODES = ("none", "int8-dynamic", "bnb-8bit", "bnb-4bit")
+# Geladenes Backend (Gerät, Quantisierung, Ladezeit, Speicher) für /stats
+backend_info = {}
+
 
 def get_model_path():
     safe_name = MODEL_NAME.replace("/", "_")
     return os.path.join(CACHE_DIR, safe_name)
 
+def _load_tokenizer():
+    new_tokenizer = AutoTokenizer.from_pretrained(
+        get_model_path(),
+        trust_remote_code=True,
+        use_auth_token=HUGGINGFACE_TOKEN,
+        local_files_only=True
+    )
+    # Für Batches links auffüllen, damit alle Prompts direkt vor den neuen Tokens enden
+    new_tokenizer.padding_side = "left"
+    if new_tokenizer.pad_token is None:
+        new_tokenizer.pad_token = new_tokenizer.eos_token
+    return new_tokenizer
+
+def init_tokenizer():
+    """Lädt nur den Tokenizer (z. B. für Token-Zählungen in Webhook-Workern ohne Modell)"""
+    global tokenizer
+    with _init_lock:
+        if tokenizer is None:
+            tokenizer = _load_tokenizer()
+
+def resident_memory_mb() -> float:
+    """Aktueller Resident Set Size des Prozesses in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Kein procfs (z. B. macOS): Spitzenwert statt aktuellem Wert
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def resolve_device(device: str = LLM_DEVICE) -> str:
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+def _model_load_kwargs(device: str, quantization: str) -> dict:
+    """Argumente für from_pretrained je nach Gerät und Quantisierung"""
+    kwargs = {
+        "trust_remote_code": True,
+        "use_auth_token": HUGGINGFACE_TOKEN,
+        "local_files_only": True,
+    }
+    if quantization in ("bnb-8bit", "bnb-4bit"):
+        # Optionale Abhängigkeit; auf CPU ist eine bitsandbytes-Version mit CPU-Backend nötig
+        from transformers import BitsAndBytesConfig
+
+        compute_dtype = torch.float16 if device == "cuda" else torch.float32
+        if quantization == "bnb-8bit":
+            kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=compute_dtype,
+            )
+        kwargs["torch_dtype"] = compute_dtype
+        kwargs["device_map"] = "auto" if device == "cuda" else {"": "cpu"}
+    elif device == "cuda":
+        kwargs["torch_dtype"] = torch.float16
+        kwargs["device_map"] = "auto"
+    else:
+        # float16-Matmuls sind auf CPU kaum unterstützt bzw. sehr langsam
+        kwargs["torch_dtype"] = torch.float32
+        kwargs["low_cpu_mem_usage"] = True
+    return kwargs
+
+def _weight_dtype(model) -> str:
+    """dtype der Gewichte der Linear-Schichten; nach quantize_dynamic sind nur diese int8,
+    der erste Parameter (Embeddings) bleibt float32"""
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            return str(module.weight().dtype)
+        if isinstance(module, torch.nn.Linear):
+            return str(module.weight.dtype)
+    return str(next(model.parameters()).dtype)
+
+def _load_model(device: str = None, quantization: str = LLM_QUANTIZATION):
+    device = resolve_device(device or LLM_DEVICE)
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unbekannte Quantisierung '{quantization}' (erlaubt: {', '.join(QUANTIZATION_MODES)})")
+    if quantization == "int8-dynamic" and device != "cpu":
+        raise ValueError("LLM_QUANTIZATION=int8-dynamic wird nur mit LLM_DEVICE=cpu unterstützt")
+    if device == "cpu" and LLM_CPU_THREADS > 0:
+        torch.set_num_threads(LLM_CPU_THREADS)
+
+    started = time.monotonic()
+    new_model = AutoModelForCausalLM.from_pretrained(get_model_path(), **_model_load_kwargs(device, quantization))
+    if quantization == "int8-dynamic":
+        # Gewichte der Linear-Schichten als int8, Aktivierungen werden pro Aufruf quantisiert
+        new_model = torch.ao.quantization.quantize_dynamic(new_model, {torch.nn.Linear}, dtype=torch.qint8)
+    new_model.eval()
+
+    backend_info.update(
+        device=device,
+        quantization=quantization,
+        dtype=_weight_dtype(new_model),
+        load_seconds=round(time.monotonic() - started, 1),
+        rss_mb_after_load=round(resident_memory_mb()),
+        cpu_threads=torch.get_num_threads(),
+    )
+    logger.info(f"Modell geladen: {backend_info}")
+    return new_model
+
 def init_model():
 
     global tokenizer, model
-    if tokenizer is None or model is None:
-        model_path = get_model_path()
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            use_auth_token=HUGGINGFACE_TOKEN,
-            local_files_only=True
-        )
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            use_auth_token=HUGGINGFACE_TOKEN,
-            device_map="auto",
-            torch_dtype=torch.float16,
-            local_files_only=True
-        )
+    # Startup und Inferenz-Worker können gleichzeitig hier ankommen
+    with _init_lock:
+        if tokenizer is None or model is None:
+            new_tokenizer = tokenizer or _load_tokenizer()
+            new_model = _load_model()
+            tokenizer, model = new_tokenizer, new_model
+            _init_prefix_cache()
+
+def _init_prefix_cache():
+    """Berechnet die past_key_values für SYSTEM_PROMPT einmalig vor"""
+    global prefix_ids, prefix_cache
+    try:
+        from transformers import DynamicCache
 
-def generate_answer(prompt: str, max_new_tokens: int = 128) -> str:
+        ids = tokenizer(SYSTEM_PROMPT, return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            past_key_values = model(input_ids=ids, use_cache=True).past_key_values
+        if not isinstance(past_key_values, DynamicCache):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        prefix_ids, prefix_cache = ids, past_key_values
+        logger.info(f"KV-Cache für System-Prompt vorberechnet ({ids.size(-1)} Tokens)")
+    except Exception as e:
+        logger.warning(f"KV-Cache für System-Prompt nicht verfügbar: {e}")
+        prefix_ids, prefix_cache = None, None
+
+def _build_inputs(prompts: List[str]) -> dict:
+    """Tokenisiert die Prompts; nutzt den Präfix-Cache, wenn alle mit SYSTEM_PROMPT beginnen"""
+    if prefix_cache is None or not all(p.startswith(SYSTEM_PROMPT) for p in prompts):
+        prefix_cache_stats["misses"] += len(prompts)
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        return {k: v.to(model.device) for k, v in inputs.items()}
+
+    # Nur der variable Teil wird tokenisiert; das Padding landet zwischen Präfix und
+    # Rest und wird über die attention_mask ausgeblendet
+    suffixes = [p[len(SYSTEM_PROMPT):] for p in prompts]
+    encoded = tokenizer(suffixes, return_tensors="pt", padding=True, add_special_tokens=False)
+    batch_size = len(prompts)
+    prefix = prefix_ids.expand(batch_size, -1)
+    input_ids = torch.cat([prefix, encoded["input_ids"].to(model.device)], dim=1)
+    attention_mask = torch.cat([
+        torch.ones_like(prefix),
+        encoded["attention_mask"].to(model.device)
+    ], dim=1)
+
+    # generate erweitert den Cache, daher immer auf einer Kopie arbeiten
+    past_key_values = copy.deepcopy(prefix_cache)
+    if batch_size > 1:
+        past_key_values.batch_repeat_interleave(batch_size)
+
+    prefix_cache_stats["hits"] += batch_size
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "past_key_values": past_key_values,
+    }
+
+def generate_answer(prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> str:
+    return generate_batch([prompt], max_new_tokens)[0][0]
+
+def generate_batch(prompts: List[str], max_new_tokens: Union[int, List[int]] = LLM_MAX_NEW_TOKENS,
+                   on_text: Optional[List[Optional[Callable[[str], None]]]] = None) -> List[Tuple[str, int, str]]:
+    """Generiert Antworten für mehrere Prompts in einem einzigen generate-Aufruf.
+
+    max_new_tokens kann pro Prompt angegeben werden; jede Zeile endet bei ihrem
+    Budget, einem Stop-String oder nach LLM_MAX_SENTENCES Sätzen, der Aufruf
+    sobald alle Zeilen fertig sind.
+    on_text enthält pro Prompt einen Callback oder None; Zeilen mit Callback erhalten
+    ihren Text während der Generierung stückweise, bereits auf Stop-String bzw.
+    Satzgrenze gekürzt.
+    Gibt pro Prompt den dekodierten Text, die Anzahl erzeugter Tokens und den
+    Abbruchgrund (eos, stop_string, sentences, budget) zurück.
+    """
     init_model()
 
-    inputs = tokenizer(prompt, return_tensors="pt")
-    inputs = {k: v.to(model.device) for k, v in inputs.items()}
+    streamer = None
+    if on_text is not None and any(callback is not None for callback in on_text):
+        if len(on_text) != len(prompts):
+            raise ValueError("on_text braucht einen Eintrag (Callback oder None) pro Prompt")
+        streamer = _BatchStreamer(on_text)
+
+    if isinstance(max_new_tokens, int):
+        max_new_tokens = [max_new_tokens] * len(prompts)
+
+    inputs = _build_inputs(prompts)
+    prompt_length = inputs["input_ids"].size(-1)
+    stop_criteria = _StopCriteria(prompt_length, max_new_tokens)
 
     outputs = model.generate(
         **inputs,
-        max_new_tokens=max_new_tokens,
-        do_sample=False
+        max_new_tokens=max(max_new_tokens),
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+        stopping_criteria=StoppingCriteriaList([stop_criteria]),
+        streamer=streamer
     )
 
-    generated_ids = outputs[0][inputs["input_ids"].size(-1):]
-    return tokenizer.decode(generated_ids, skip_special_tokens=True)
+    results = []
+    for i, (row, budget) in enumerate(zip(outputs, max_new_tokens)):
+        generated_ids = row[prompt_length:prompt_length + budget]
+        count = _count_generated_tokens(generated_ids)
+        reason = stop_criteria.reasons[i] or ("budget" if count >= budget else "eos")
+        results.append((trim_answer(tokenizer.decode(generated_ids, skip_special_tokens=True)), count, reason))
+    return results
+
+# Satzende nur mit folgendem Leerraum, damit "2." in "2.5" nicht zählt
+_SENTENCE_END = re.compile(r"[.!?](?=\s)")
+# Abkürzungen, nach denen ein Punkt kein Satzende ist (klein geschrieben, ohne letzten Punkt)
+_ABBREVIATIONS = frozenset(
+    "approx ca vs incl excl nr oz fl min max dr mr mrs ms jr sr st inc ltd co corp dept est "
+    "mfg qty pcs pkg dia ref bzw ggf inkl evtl".split()
+)
+# Einzelne Buchstaben mit Punkten: "a.m", "p.m", "e.g", "i.e", "u.s", "z.b", "d.h"
+_DOTTED_ABBREVIATION = re.compile(r"(?:[a-z]\.)+[a-z]")
+
+def _is_sentence_end(text: str, position: int) -> bool:
+    """Prüft einen Punkt auf Listennummern ("1. "), Initialen ("J. ") und Abkürzungen ("a.m. ", "approx. ")"""
+    if text[position] != ".":
+        return True
+    line = text[text.rfind("\n", 0, position) + 1:position].strip()
+    if line.isdigit():
+        return False
+    words = line.split()
+    if not words:
+        return True
+    word = words[-1].lstrip("(").lower()
+    is_abbreviation = (
+        (len(word) == 1 and word.isalpha()) or word in _ABBREVIATIONS or _DOTTED_ABBREVIATION.fullmatch(word)
+    )
+    return not is_abbreviation
+
+def _find_stop(text: str) -> Tuple[Optional[int], Optional[str]]:
+    """Position, an der die Antwort endet (Stop-String oder Satzgrenze), und der Grund"""
+    end, reason = None, None
+    for stop in LLM_STOP_STRINGS:
+        position = text.find(stop)
+        if position != -1 and (end is None or position < end):
+            end, reason = position, "stop_string"
+    if LLM_MAX_SENTENCES > 0:
+        count = 0
+        for match in _SENTENCE_END.finditer(text, 0, end if end is not None else len(text)):
+            if not _is_sentence_end(text, match.start()):
+                continue
+            count += 1
+            if count == LLM_MAX_SENTENCES:
+                return match.end(), "sentences"
+    return end, reason
+
+def trim_answer(text: str) -> str:
+    """Schneidet die Antwort am ersten Stop-String bzw. nach LLM_MAX_SENTENCES Sätzen ab"""
+    end, _ = _find_stop(text)
+    return (text if end is None else text[:end]).strip()
+
+class _StopCriteria(StoppingCriteria):
+    """Beendet einzelne Zeilen eines Batches bei Budget, Stop-String oder Satzgrenze"""
+
+    def __init__(self, prompt_length: int, budgets: List[int]):
+        self.prompt_length = prompt_length
+        self.budgets = budgets
+        self.reasons: List[Optional[str]] = [None] * len(budgets)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for i, row in enumerate(input_ids):
+            generated = row[self.prompt_length:]
+            if self.reasons[i] is None and generated.size(-1) < self.budgets[i]:
+                # Der Stop-String kann über mehrere Tokens verteilt sein, daher den ganzen Text prüfen
+                _, self.reasons[i] = _find_stop(tokenizer.decode(generated, skip_special_tokens=True))
+            done.append(self.reasons[i] is not None or generated.size(-1) >= self.budgets[i])
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+def answer_budget(question: str, intent_budget: Optional[int] = None) -> int:
+    """Token-Budget für eine Antwort: pro Intent festgelegt oder aus der Art der Frage"""
+    if intent_budget:
+        return intent_budget
+    words = question.split()
+    if len(words) <= LLM_SHORT_QUESTION_WORDS and words and words[0].lower() in _SHORT_QUESTION_WORDS:
+        return LLM_SHORT_ANSWER_TOKENS
+    return LLM_MAX_NEW_TOKENS
+
+# Fragewörter, auf die meist eine kurze Faktenantwort folgt ("why"/"how" fehlen absichtlich)
+_SHORT_QUESTION_WORDS = {
+    "who", "what", "what's", "whats", "when", "where", "which", "is", "are", "do", "does", "can",
+    "wer", "was", "wann", "wo", "welche", "welcher", "ist", "sind", "gibt",
+}
+
+class _BatchStreamer(BaseStreamer):
+    """Verteilt die Tokens eines Batches zeilenweise an die Callbacks der Zeilen.
+
+    generate übergibt pro Schritt ein Token je Zeile. Pro Zeile wird der bisher erzeugte
+    Text dekodiert und nur bis zum letzten Leerraum weitergereicht, damit keine halben
+    Wörter oder unvollständigen Zeichen ankommen. Endet die Zeile an einem Stop-String oder
+    einer Satzgrenze, geht nur der Text bis dorthin raus; das Padding nach dem Ende einer
+    Zeile wird ignoriert.
+    """
+
+    def __init__(self, on_text: List[Optional[Callable[[str], None]]]):
+        self.on_text = on_text
+        self.tokens: List[List[int]] = [[] for _ in on_text]
+        self.sent = [0] * len(on_text)  # Bereits weitergereichte Zeichen pro Zeile
+        self.finished = [callback is None for callback in on_text]
+        self.prompt_skipped = False
+
+    def put(self, value):
+        if not self.prompt_skipped:
+            # Der erste Aufruf enthält die Prompt-Tokens
+            self.prompt_skipped = True
+            return
+        for i, token_ids in enumerate(value.reshape(len(self.tokens), -1).tolist()):
+            if not self.finished[i]:
+                self.tokens[i].extend(token_ids)
+                self._emit(i, final=False)
+
+    def end(self):
+        for i in range(len(self.tokens)):
+            if not self.finished[i]:
+                self._emit(i, final=True)
+
+    def _emit(self, i: int, final: bool):
+        text = tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+        end, _ = _find_stop(text)
+        if end is not None:
+            text, final = text[:end], True
+        elif not final:
+            # Nur bis zum letzten Leerraum, der Rest kann sich mit dem nächsten Token noch ändern
+            text = text[:max(text.rfind(" "), text.rfind("\n")) + 1]
+        if len(text) > self.sent[i]:
+            self.on_text[i](text[self.sent[i]:])
+            self.sent[i] = len(text)
+        if final:
+            self.finished[i] = True
+
+def _count_generated_tokens(generated_ids) -> int:
+    # Nach dem ersten Stop-Token folgt bei Batches nur noch Padding
+    stop_ids = model.generation_config.eos_token_id
+    if stop_ids is None:
+        stop_ids = tokenizer.eos_token_id
+    if isinstance(stop_ids, int):
+        stop_ids = [stop_ids]
+    # Zeilen, die per StoppingCriteria beendet wurden, werden mit pad_token aufgefüllt
+    stop_ids = list(stop_ids) + [tokenizer.pad_token_id]
+    for position, token_id in enumerate(generated_ids.tolist()):
+        if token_id in stop_ids:
+            return position + 1
+    return len(generated_ids)
 
 def get_pipeline():
     """Gibt eine Pipeline für die Textgenerierung zurück"""
@@ -68,4 +415,235 @@ def get_pipeline():
         trust_remote_code=True
     )
     
-    return pipe
\ No newline at end of file
+    return pipe
+
+
+class InferenceWorker:
+    """Führt die Textgenerierung in eigenen Threads mit begrenzter Warteschlange aus.
+
+    Anfragen, die innerhalb des Batch-Fensters eintreffen, werden zu einem
+    gemeinsamen generate-Aufruf zusammengefasst (dynamisches Micro-Batching).
+    """
+
+    def __init__(self, num_workers: int = LLM_WORKERS, queue_size: int = LLM_QUEUE_SIZE,
+                 max_batch_size: int = LLM_MAX_BATCH_SIZE, batch_window_ms: int = LLM_BATCH_WINDOW_MS):
+        self.num_workers = max(1, num_workers)
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = max(0, batch_window_ms) / 1000
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "busy_workers": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "total_run_seconds": 0.0,
+            "batches": 0,
+            "generated_tokens": 0,
+            "generate_seconds": 0.0,
+        }
+        self.batch_sizes = Counter()
+        self.stop_reasons = Counter()
+        # Tatsächlich erzeugte Tokens pro Budget, um die Budgets aus Produktionsdaten abzuleiten
+        self.budgets = {}
+
+    def start(self):
+        """Startet die Worker-Threads (nur beim ersten Aufruf)"""
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"llm-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, prompt: str, max_new_tokens: int, loop: asyncio.AbstractEventLoop,
+               on_text: Optional[Callable[[str], None]] = None) -> asyncio.Future:
+        """Reiht eine Generierung ein; wirft queue.Full, wenn die Warteschlange voll ist.
+
+        on_text wird (aus dem Worker-Thread) mit jedem neu dekodierten Textstück aufgerufen.
+        """
+        self.start()
+        future = loop.create_future()
+        job = {
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "on_text": on_text,
+            "future": future,
+            "loop": loop,
+            "enqueued_at": time.monotonic(),
+        }
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.stats["rejected"] += 1
+            logger.warning(f"Inferenz-Warteschlange voll ({self.jobs.maxsize}), Anfrage abgelehnt")
+            raise
+
+        with self.lock:
+            self.stats["submitted"] += 1
+        return future
+
+    def _collect_batch(self) -> list:
+        """Wartet auf eine Anfrage und sammelt weitere bis zum Ende des Batch-Fensters"""
+        batch = [self.jobs.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.jobs.get(timeout=remaining))
+                else:
+                    # Bereits wartende Anfragen trotzdem mitnehmen
+                    batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Streaming-Anfragen laufen im selben Batch; der Streamer verteilt die Tokens pro Zeile
+            self._process(self._collect_batch())
+
+    def _process(self, batch: list):
+        started = time.monotonic()
+        with self.lock:
+            self.stats["busy_workers"] += 1
+            self.stats["batches"] += 1
+            self.batch_sizes[len(batch)] += 1
+            for job in batch:
+                wait = started - job["enqueued_at"]
+                self.stats["total_wait_seconds"] += wait
+                self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+
+        results, error = None, None
+        try:
+            results = generate_batch(
+                [job["prompt"] for job in batch],
+                [job["max_new_tokens"] for job in batch],
+                on_text=[job["on_text"] for job in batch]
+            )
+        except Exception as e:
+            logger.error(f"Fehler bei der Textgenerierung (Batch-Größe {len(batch)}): {e}")
+            error = e
+
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.stats["busy_workers"] -= 1
+            self.stats["total_run_seconds"] += elapsed * len(batch)
+            self.stats["failed" if error else "completed"] += len(batch)
+            if results:
+                self.stats["generated_tokens"] += sum(count for _, count, _ in results)
+                self.stats["generate_seconds"] += elapsed
+                for job, (_, count, reason) in zip(batch, results):
+                    self.stop_reasons[reason] += 1
+                    budget = self.budgets.setdefault(
+                        job["max_new_tokens"], {"answers": 0, "generated_tokens": 0, "max_tokens": 0, "hit_budget": 0}
+                    )
+                    budget["answers"] += 1
+                    budget["generated_tokens"] += count
+                    budget["max_tokens"] = max(budget["max_tokens"], count)
+                    budget["hit_budget"] += reason == "budget"
+
+        for i, job in enumerate(batch):
+            result = results[i][0] if results else None
+            job["loop"].call_soon_threadsafe(_resolve_future, job["future"], result, error)
+            self.jobs.task_done()
+
+    async def generate(self, prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> str:
+        """Generiert im lokalen Worker, ohne den Event-Loop zu blockieren"""
+        loop = asyncio.get_running_loop()
+        return await self.submit(prompt, max_new_tokens, loop)
+
+    async def stream(self, prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> AsyncIterator[str]:
+        """Liefert die Antwort des lokalen Workers stückweise"""
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def on_text(text: str):
+            loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+        future = self.submit(prompt, max_new_tokens, loop, on_text=on_text)
+        # Die Textstücke werden vor dem Ergebnis eingereiht, das Ende-Signal kommt also zuletzt
+        future.add_done_callback(lambda _: chunks.put_nowait(None))
+
+        while True:
+            text = await chunks.get()
+            if text is None:
+                break
+            yield text
+
+        # Wirft die Exception der Generierung, falls eine aufgetreten ist
+        await future
+
+    def get_stats(self) -> dict:
+        """Gibt Warteschlangentiefe, Wartezeiten und Batch-Metriken zurück"""
+        with self.lock:
+            stats = dict(self.stats)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            stop_reasons = dict(self.stop_reasons)
+            budgets = {
+                budget: dict(values, avg_tokens=values["generated_tokens"] / values["answers"])
+                for budget, values in sorted(self.budgets.items())
+            }
+        finished = stats["completed"] + stats["failed"]
+        stats["workers"] = self.num_workers
+        stats["max_batch_size"] = self.max_batch_size
+        stats["batch_window_ms"] = self.batch_window * 1000
+        stats["batch_sizes"] = batch_sizes
+        stats["stop_reasons"] = stop_reasons
+        stats["budgets"] = budgets
+        stats["avg_batch_size"] = finished / stats["batches"] if stats["batches"] else 0.0
+        stats["tokens_per_second"] = (
+            stats["generated_tokens"] / stats["generate_seconds"] if stats["generate_seconds"] else 0.0
+        )
+        stats["backend"] = dict(backend_info, rss_mb=round(resident_memory_mb()))
+        stats["prefix_cache"] = dict(
+            prefix_cache_stats,
+            enabled=prefix_cache is not None,
+            prefix_tokens=prefix_ids.size(-1) if prefix_ids is not None else 0
+        )
+        stats["queue_depth"] = self.jobs.qsize()
+        stats["queue_size"] = self.jobs.maxsize
+        stats["avg_wait_seconds"] = stats["total_wait_seconds"] / finished if finished else 0.0
+        stats["avg_run_seconds"] = stats["total_run_seconds"] / finished if finished else 0.0
+        return stats
+
+
+def _resolve_future(future: asyncio.Future, result, error):
+    # Der Aufrufer kann inzwischen abgebrochen haben
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+# Singleton-Instanz
+inference_worker = InferenceWorker()
+
+
+async def generate_answer_async(prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> str:
+    """Awaitbare Variante von generate_answer, die den Event-Loop nicht blockiert"""
+    if MODEL_SERVER_ADDRESS:
+        # Erst hier importieren, um zirkuläre Importe zu vermeiden
+        from .model_server import model_client
+        return await model_client.generate(prompt, max_new_tokens)
+    return await inference_worker.generate(prompt, max_new_tokens)
+
+
+async def stream_answer(prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> AsyncIterator[str]:
+    """Liefert die Antwort stückweise, sobald neue Tokens dekodiert sind"""
+    if MODEL_SERVER_ADDRESS:
+        from .model_server import model_client
+        chunks = model_client.stream(prompt, max_new_tokens)
+    else:
+        chunks = inference_worker.stream(prompt, max_new_tokens)
+    async for text in chunks:
+        yield text
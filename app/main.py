@@ -1,14 +1,158 @@
-from fastapi import FastAPI, Request
-from .bot import handle_webhook
-from .config import CACHE_DIR
+import asyncio
+import csv
+import io
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from .bot import handle_webhook, application, dispatcher
+from .config import CACHE_DIR, ADMIN_TOKEN, INDEX_RELOAD_INTERVAL, MODEL_SERVER_ADDRESS, RESPONSES_RESUME_INTERVAL
+from .llm import inference_worker, init_model
+from .model_server import model_client, connect_model_server
+from .answer_cache import answer_cache
+from .embeddings import query_encoder
+from .intents import intent_router
+from .retrieval import retriever
+from .prompt import prompt_builder
+from .startup import startup
+from .questionnaire import questionnaire_manager
+from .outbox import outbox
+from .pdf_handler import pdf_handler
+from .response_store import response_store
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Alles wird parallel im Hintergrund geladen, damit uvicorn sofort Anfragen annimmt;
+    # der Fragebogen funktioniert bereits, bevor das LLM bereit ist
+    startup.add("telegram", application.initialize)
+    startup.add("embedder", query_encoder.load)
+    startup.add("intents", intent_router.load)
+    startup.add("index", retriever.load)
+    # Mit Modell-Server lädt dieser Worker nur den Tokenizer und verbindet sich
+    startup.add("model", connect_model_server if MODEL_SERVER_ADDRESS else init_model)
+    tasks = [asyncio.create_task(startup.run())]
+    dispatcher.start()
+    # Versendet auch E-Mails, die vor einem Neustart liegen geblieben sind
+    outbox.start()
+    # Frage-Index einmalig aufbauen; die Render-Prozesse starten beim ersten Fragebogen
+    pdf_handler.start(questionnaire_manager.questions)
+    # Fragebögen, deren E-Mail vor einem Neustart nicht mehr in die Outbox kam
+    pdf_handler.resume_unsent()
+    if RESPONSES_RESUME_INTERVAL > 0:
+        tasks.append(asyncio.create_task(pdf_handler.watch_unsent(RESPONSES_RESUME_INTERVAL)))
+    if INDEX_RELOAD_INTERVAL > 0:
+        tasks.append(asyncio.create_task(retriever.watch(INDEX_RELOAD_INTERVAL)))
+
+    yield
+
+    await dispatcher.stop()
+    for task in tasks:
+        task.cancel()
+    if startup.is_ready("telegram"):
+        await application.shutdown()
+    # Ausstehende Session-Änderungen schreiben
+    questionnaire_manager.active_sessions.close()
+    # Eingereihte Fragebögen schreiben (startet deren PDFs), dann die laufenden Renderings
+    # abschließen und die Outbox stoppen; die Datenbank erst danach schließen, weil
+    # abgeschlossene Renderings noch mark_emailed aufrufen
+    await asyncio.to_thread(response_store.stop)
+    await asyncio.to_thread(pdf_handler.shutdown)
+    await asyncio.to_thread(outbox.stop)
+    await asyncio.to_thread(response_store.close)
+
+app = FastAPI(lifespan=lifespan)
+
+
+def check_admin(request: Request):
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="forbidden")
 
 
 @app.get("/health")
 def health():
     return {"status":"ok", "model_cache": CACHE_DIR}
 
+@app.get("/ready")
+def ready():
+    """Bereitschaft inkl. Ladezeiten pro Komponente; 503, solange nicht alles geladen ist"""
+    status = startup.get_status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/stats")
+async def stats():
+    if MODEL_SERVER_ADDRESS:
+        try:
+            inference = await model_client.get_stats()
+        except Exception as e:
+            inference = {"error": str(e)}
+    else:
+        inference = inference_worker.get_stats()
+    intents = intent_router.get_stats()
+    # Grobe Schätzung der eingesparten LLM-Zeit anhand der mittleren Generierungsdauer
+    intents["estimated_llm_seconds_saved"] = intents["routed"] * inference.get("avg_run_seconds", 0.0)
+    return {
+        "updates": dispatcher.get_stats(),
+        "inference": inference,
+        "intents": intents,
+        "answer_cache": answer_cache.get_stats(),
+        "embeddings": query_encoder.get_stats(),
+        "retrieval": retriever.get_stats(),
+        "prompt": prompt_builder.get_stats(),
+        "questionnaire": questionnaire_manager.get_stats(),
+        "sessions": questionnaire_manager.active_sessions.get_stats(),
+        "responses": response_store.get_stats(),
+        "pdf": pdf_handler.get_stats(),
+        "outbox": outbox.get_stats(),
+    }
+
+@app.post("/admin/reload-index")
+async def reload_index(request: Request):
+    """Lädt company.index und company_texts.json im Hintergrund neu"""
+    check_admin(request)
+    try:
+        swapped = await asyncio.to_thread(retriever.reload, True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"ok": swapped, "retrieval": retriever.get_stats()}
+
+@app.get("/admin/responses")
+def export_responses(request: Request, day: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, product_development_type: Optional[str] = None,
+                     format: str = "jsonl"):
+    """Exportiert gespeicherte Fragebögen als JSON Lines oder CSV, gefiltert nach Tag/Zeitraum (YYYY-MM-DD)
+    und Art der Produktentwicklung. Die Antwort wird gestreamt und nie vollständig im Speicher gehalten."""
+    check_admin(request)
+    if format not in ("jsonl", "csv"):
+        raise HTTPException(status_code=400, detail="format muss jsonl oder csv sein")
+    rows = response_store.iter_responses(day=day, since=since, until=until,
+                                         product_development_type=product_development_type)
+    if format == "jsonl":
+        return StreamingResponse((json.dumps(row) + "\n" for row in rows), media_type="application/x-ndjson")
+
+    question_ids = [q.id for q in questionnaire_manager.questions]
+
+    def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["id", "chat_id", "start_time", "end_time", "emailed"] + question_ids)
+        for row in rows:
+            responses = row.get("responses", {})
+            writer.writerow([row["id"], row.get("chat_id"), row.get("start_time"), row.get("end_time"), row["emailed"]]
+                            + [responses.get(qid, "") for qid in question_ids])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    return StreamingResponse(csv_lines(), media_type="text/csv")
+
+@app.get("/admin/responses/summary")
+def responses_summary(request: Request, since: Optional[str] = None, until: Optional[str] = None):
+    """Anzahl gespeicherter Fragebögen pro Tag und Art der Produktentwicklung"""
+    check_admin(request)
+    return {"summary": response_store.summary(since, until)}
+
 @app.post("/webhook")
 async def webhook(request: Request):  # <-- wichtig: Request, nicht dict!
-    return await handle_webhook(request)
\ No newline at end of file
+    return await handle_webhook(request)
@@ -0,0 +1,259 @@
+"""Gemeinsamer Modell-Server für den Betrieb mit mehreren Webhook-Workern.
+
+Ein einzelner Prozess lädt das LLM und bündelt die Anfragen aller Worker im
+InferenceWorker; die uvicorn-Worker sprechen ihn über einen lokalen Socket an:
+
+    export MODEL_SERVER_ADDRESS=/tmp/ps_chatbot_model.sock MODEL_SERVER_AUTHKEY=$(openssl rand -hex 32)
+    python -m app.model_server
+    uvicorn app.main:app --workers 4
+"""
+import asyncio
+import ipaddress
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from typing import AsyncIterator
+
+from .config import (
+    MODEL_SERVER_ADDRESS, MODEL_SERVER_AUTHKEY, MODEL_SERVER_ALLOW_REMOTE, MODEL_SERVER_CONNECT_TIMEOUT,
+    LLM_MAX_NEW_TOKENS
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address: str):
+    """Unix-Socket-Pfad oder host:port in eine Adresse für multiprocessing.connection umwandeln"""
+    if address.startswith("/") or address.startswith("."):
+        return address, "AF_UNIX"
+    host, port = address.rsplit(":", 1)
+    return (host, int(port)), "AF_INET"
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_connection_settings(address: str, authkey: str):
+    """Lehnt unsichere Einstellungen ab: ohne Schlüssel oder über das Netz ohne ausdrückliche Freigabe"""
+    if not address:
+        raise ValueError("MODEL_SERVER_ADDRESS ist nicht gesetzt")
+    if not authkey:
+        raise ValueError("MODEL_SERVER_AUTHKEY muss gesetzt sein (z. B. openssl rand -hex 32)")
+    parsed, family = parse_address(address)
+    if family == "AF_INET" and not _is_loopback(parsed[0]) and not MODEL_SERVER_ALLOW_REMOTE:
+        raise ValueError(
+            f"MODEL_SERVER_ADDRESS {address} ist nicht lokal; nur mit MODEL_SERVER_ALLOW_REMOTE=true "
+            "in einem vertrauenswürdigen Netz verwenden"
+        )
+
+
+class ModelServer:
+    """Besitzt das Modell und beantwortet Anfragen der Webhook-Worker"""
+
+    def __init__(self, address: str = MODEL_SERVER_ADDRESS, authkey: str = MODEL_SERVER_AUTHKEY):
+        check_connection_settings(address, authkey)
+        self.address, self.family = parse_address(address)
+        self.authkey = authkey.encode("utf-8")
+        self.loop = None
+
+    def serve_forever(self):
+        from .llm import init_model, inference_worker
+
+        logger.info("Lade Modell...")
+        init_model()
+        inference_worker.start()
+
+        # Die Anfragen laufen auf einem eigenen Event-Loop, damit das Micro-Batching
+        # des InferenceWorker Anfragen aller Verbindungen zusammenfassen kann
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="model-server-loop", daemon=True).start()
+
+        if self.family == "AF_UNIX" and os.path.exists(self.address):
+            os.unlink(self.address)
+        # Unix-Socket nur für den eigenen Benutzer anlegen (ohne Zeitfenster bis zu einem chmod)
+        previous_umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family=self.family, authkey=self.authkey)
+        finally:
+            os.umask(previous_umask)
+        with listener:
+            logger.info(f"Modell-Server wartet auf {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # z. B. falscher authkey
+                    logger.warning(f"Verbindung abgelehnt: {e}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def send(message: dict):
+            try:
+                with send_lock:
+                    conn.send(message)
+            except OSError:
+                # Worker wurde beendet, das Ergebnis wird nicht mehr gebraucht
+                pass
+
+        logger.info("Webhook-Worker verbunden")
+        try:
+            while True:
+                request = conn.recv()
+                asyncio.run_coroutine_threadsafe(self._handle_request(request, send), self.loop)
+        except (EOFError, OSError):
+            logger.info("Webhook-Worker getrennt")
+        finally:
+            conn.close()
+
+    async def _handle_request(self, request: dict, send):
+        from .llm import inference_worker
+
+        request_id = request["id"]
+        try:
+            if request["type"] == "generate":
+                result = await inference_worker.generate(request["prompt"], request["max_new_tokens"])
+                send({"id": request_id, "done": True, "result": result})
+            elif request["type"] == "stream":
+                async for text in inference_worker.stream(request["prompt"], request["max_new_tokens"]):
+                    send({"id": request_id, "text": text})
+                send({"id": request_id, "done": True})
+            elif request["type"] == "stats":
+                send({"id": request_id, "done": True, "result": inference_worker.get_stats()})
+            else:
+                send({"id": request_id, "error": f"Unbekannter Anfragetyp {request['type']}"})
+        except queue.Full:
+            send({"id": request_id, "error": "busy", "busy": True})
+        except Exception as e:
+            logger.error(f"Fehler bei Anfrage {request_id}: {e}")
+            send({"id": request_id, "error": str(e)})
+
+
+class ModelClient:
+    """Verbindung eines Webhook-Workers zum Modell-Server.
+
+    Alle Anfragen eines Prozesses teilen sich eine Verbindung; ein Lese-Thread
+    verteilt die Antworten anhand der Anfrage-ID an die wartenden Coroutinen.
+    """
+
+    def __init__(self, address: str = MODEL_SERVER_ADDRESS, authkey: str = MODEL_SERVER_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.conn = None
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.requests = {}  # request_id -> (loop, asyncio.Queue)
+
+    def connect(self):
+        """Baut die Verbindung auf (nur wenn noch keine besteht)"""
+        with self.lock:
+            if self.conn is not None:
+                return
+            check_connection_settings(self.address, self.authkey)
+            address, family = parse_address(self.address)
+            self.conn = Client(address, family=family, authkey=self.authkey.encode("utf-8"))
+            threading.Thread(target=self._read_loop, args=(self.conn,), name="model-client-reader", daemon=True).start()
+            logger.info(f"Mit Modell-Server {self.address} verbunden")
+
+    def _read_loop(self, conn):
+        try:
+            while True:
+                message = conn.recv()
+                entry = self.requests.get(message["id"])
+                if entry is not None:
+                    loop, responses = entry
+                    loop.call_soon_threadsafe(responses.put_nowait, message)
+        except (EOFError, OSError) as e:
+            logger.error(f"Verbindung zum Modell-Server verloren: {e}")
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+        # Offene Anfragen beenden; die nächste Anfrage verbindet sich neu
+        for request_id, (loop, responses) in list(self.requests.items()):
+            loop.call_soon_threadsafe(responses.put_nowait, {"id": request_id, "error": "Verbindung verloren"})
+
+    async def _request(self, payload: dict) -> AsyncIterator[dict]:
+        if self.conn is None:
+            await asyncio.to_thread(self.connect)
+
+        request_id = next(self.request_ids)
+        responses = asyncio.Queue()
+        self.requests[request_id] = (asyncio.get_running_loop(), responses)
+        try:
+            with self.lock:
+                if self.conn is None:
+                    raise ConnectionError("Keine Verbindung zum Modell-Server")
+                self.conn.send(dict(payload, id=request_id))
+            while True:
+                message = await responses.get()
+                if "error" in message:
+                    if message.get("busy"):
+                        raise queue.Full()
+                    raise RuntimeError(f"Modell-Server: {message['error']}")
+                yield message
+                if message.get("done"):
+                    break
+        finally:
+            self.requests.pop(request_id, None)
+
+    async def generate(self, prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> str:
+        async for message in self._request({"type": "generate", "prompt": prompt, "max_new_tokens": max_new_tokens}):
+            if message.get("done"):
+                return message["result"]
+
+    async def stream(self, prompt: str, max_new_tokens: int = LLM_MAX_NEW_TOKENS) -> AsyncIterator[str]:
+        async for message in self._request({"type": "stream", "prompt": prompt, "max_new_tokens": max_new_tokens}):
+            if "text" in message:
+                yield message["text"]
+
+    async def get_stats(self) -> dict:
+        async for message in self._request({"type": "stats"}):
+            if message.get("done"):
+                return message["result"]
+
+
+def connect_model_server(timeout: float = MODEL_SERVER_CONNECT_TIMEOUT):
+    """Startup-Loader für Webhook-Worker: Tokenizer laden und mit dem Modell-Server verbinden.
+
+    Der Server öffnet seinen Socket erst, wenn das Modell geladen ist. Werden Server und Worker
+    gleichzeitig gestartet, wird der Verbindungsaufbau daher mit Backoff wiederholt; "model"
+    gilt erst nach einer erfolgreichen Verbindung als bereit.
+    """
+    from .llm import init_tokenizer
+
+    # Fehlkonfiguration sofort melden statt bis zum Timeout zu wiederholen
+    check_connection_settings(model_client.address, model_client.authkey)
+    init_tokenizer()
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    while True:
+        try:
+            model_client.connect()
+            return
+        except (ConnectionError, FileNotFoundError) as e:
+            if time.monotonic() + delay > deadline:
+                raise ConnectionError(f"Modell-Server {model_client.address} nach {timeout:.0f}s nicht erreichbar: {e}")
+            logger.info(f"Modell-Server noch nicht erreichbar ({e}), neuer Versuch in {delay:.1f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+
+# Singleton-Instanz
+model_client = ModelClient()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ModelServer().serve_forever()
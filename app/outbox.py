@@ -0,0 +1,263 @@
+import fcntl
+import json
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+import logging
+from email.message import Message
+from email.utils import getaddresses
+from pathlib import Path
+from typing import Optional
+
+from .config import (
+    EMAIL_SENDER, EMAIL_PASSWORD, SMTP_SERVER, SMTP_PORT, SMTP_STARTTLS, SMTP_SSL, SMTP_TIMEOUT,
+    OUTBOX_DIR, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX, OUTBOX_IDLE_TIMEOUT,
+    OUTBOX_POLL_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class EmailOutbox:
+    """Dauerhafte Warteschlange für ausgehende E-Mails.
+
+    Jede Sendung liegt als <id>.eml (fertige Nachricht) und <id>.json (Empfänger,
+    Versuche, nächster Versuch) im Outbox-Verzeichnis; die JSON-Datei wird zuletzt
+    geschrieben und markiert die Sendung als vollständig. Ein einzelner Sender-Thread
+    verschickt sie über eine wiederverwendete, angemeldete SMTP-Verbindung und
+    wiederholt Fehlschläge mit exponentiellem Backoff. Laufen mehrere Worker, sendet
+    nur der Prozess, der die Sperrdatei hält. Endgültig fehlgeschlagene Sendungen
+    landen in failed/.
+    """
+
+    def __init__(self, directory: str = OUTBOX_DIR, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 retry_base: float = OUTBOX_RETRY_BASE, retry_max: float = OUTBOX_RETRY_MAX,
+                 idle_timeout: float = OUTBOX_IDLE_TIMEOUT, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.directory = Path(directory)
+        self.failed_dir = self.directory / "failed"
+        self.failed_dir.mkdir(exist_ok=True, parents=True)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.smtp_last_used = 0.0
+        self.lock_file = None
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "retries": 0,
+            "failed": 0,
+            "connections": 0,
+            "reused_connection_sends": 0,
+            "last_error": None,
+        }
+
+    def enqueue(self, msg: Message) -> str:
+        """Legt eine Nachricht dauerhaft in die Outbox; gibt die ID der Sendung zurück"""
+        recipients = [address for _, address in getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []))]
+        if not recipients:
+            raise ValueError("E-Mail ohne Empfänger")
+
+        message_id = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+        _write_atomic(self.directory / f"{message_id}.eml", msg.as_bytes())
+        meta = {
+            "from": msg["From"] or EMAIL_SENDER,
+            "to": recipients,
+            "subject": msg["Subject"],
+            "created": time.time(),
+            "attempts": 0,
+            "next_attempt": 0.0,
+            "last_error": None,
+        }
+        _write_atomic(self.directory / f"{message_id}.json", json.dumps(meta).encode("utf-8"))
+
+        self.stats["queued"] += 1
+        logger.info(f"E-Mail '{meta['subject']}' in die Outbox gelegt ({message_id})")
+        self.wakeup.set()
+        return message_id
+
+    def start(self):
+        """Startet den Sender-Thread (nur beim ersten Aufruf)"""
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+        self._close_connection()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def _acquire_sender_lock(self) -> bool:
+        """Nur ein Prozess pro Outbox-Verzeichnis versendet"""
+        if self.lock_file is not None:
+            return True
+        lock_file = open(self.directory / ".sender.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        logger.info("Dieser Prozess versendet die E-Mails aus der Outbox")
+        return True
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            timeout = self.poll_interval
+            if self._acquire_sender_lock():
+                try:
+                    next_attempt = self._send_due()
+                    if next_attempt is not None:
+                        timeout = min(timeout, max(0.0, next_attempt - time.time()))
+                    if self.smtp is not None and time.monotonic() - self.smtp_last_used > self.idle_timeout:
+                        self._close_connection()
+                except Exception as e:
+                    logger.error(f"Fehler im Outbox-Sender: {e}")
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+    def _send_due(self) -> Optional[float]:
+        """Versendet alle fälligen Sendungen; gibt den Zeitpunkt der nächsten zurück"""
+        next_attempt = None
+        for meta_path in sorted(self.directory.glob("*.json")):
+            if self.stop_event.is_set():
+                break
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["next_attempt"] > time.time():
+                next_attempt = min(next_attempt or meta["next_attempt"], meta["next_attempt"])
+                continue
+
+            eml_path = meta_path.with_suffix(".eml")
+            try:
+                self._send(meta, eml_path.read_bytes())
+            except Exception as e:
+                retry_at = self._handle_failure(meta_path, meta, e)
+                if retry_at is not None:
+                    next_attempt = min(next_attempt or retry_at, retry_at)
+                continue
+
+            meta_path.unlink()
+            eml_path.unlink(missing_ok=True)
+            self.stats["sent"] += 1
+            logger.info(f"E-Mail '{meta['subject']}' gesendet an {', '.join(meta['to'])}")
+        return next_attempt
+
+    def _connect(self) -> smtplib.SMTP:
+        if SMTP_SSL:
+            smtp = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_STARTTLS:
+                smtp.starttls()
+        if EMAIL_PASSWORD:  # Nur anmelden, wenn ein Passwort gesetzt ist
+            smtp.login(EMAIL_SENDER, EMAIL_PASSWORD)
+        self.stats["connections"] += 1
+        return smtp
+
+    def _close_connection(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+    def _send(self, meta: dict, data: bytes):
+        reused = self.smtp is not None
+        if not reused:
+            self.smtp = self._connect()
+        try:
+            self.smtp.sendmail(meta["from"], meta["to"], data)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self._close_connection()
+            if not reused:
+                raise
+            # Der Server hat die wiederverwendete Verbindung inzwischen geschlossen
+            self.smtp = self._connect()
+            reused = False
+            self.smtp.sendmail(meta["from"], meta["to"], data)
+        except smtplib.SMTPException:
+            # Verbindung nach einem Fehler nicht weiterverwenden
+            self._close_connection()
+            raise
+        if reused:
+            self.stats["reused_connection_sends"] += 1
+        self.smtp_last_used = time.monotonic()
+
+    @staticmethod
+    def _is_permanent(error: Exception) -> bool:
+        # 5xx-Antworten (z. B. unbekannter Empfänger) ändern sich durch Wiederholen nicht;
+        # Anmeldefehler schon, sobald die Konfiguration korrigiert ist
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(500 <= code < 600 for code, _ in error.recipients.values())
+        return (
+            isinstance(error, smtplib.SMTPResponseException)
+            and not isinstance(error, smtplib.SMTPAuthenticationError)
+            and 500 <= error.smtp_code < 600
+        )
+
+    def _handle_failure(self, meta_path: Path, meta: dict, error: Exception) -> Optional[float]:
+        """Plant den nächsten Versuch oder verschiebt die Sendung nach failed/"""
+        meta["attempts"] += 1
+        meta["last_error"] = str(error)
+        self.stats["last_error"] = str(error)
+
+        if meta["attempts"] >= self.max_attempts or self._is_permanent(error):
+            _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+            eml_path = meta_path.with_suffix(".eml")
+            if eml_path.exists():
+                os.replace(eml_path, self.failed_dir / eml_path.name)
+            os.replace(meta_path, self.failed_dir / meta_path.name)
+            self.stats["failed"] += 1
+            logger.error(f"E-Mail '{meta['subject']}' nach {meta['attempts']} Versuchen aufgegeben: {error}")
+            return None
+
+        delay = min(self.retry_max, self.retry_base * 2 ** (meta["attempts"] - 1))
+        # Etwas Jitter, damit nach einem Ausfall nicht alles gleichzeitig gesendet wird
+        meta["next_attempt"] = time.time() + delay * random.uniform(0.8, 1.2)
+        _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        self.stats["retries"] += 1
+        logger.warning(
+            f"E-Mail '{meta['subject']}' nicht gesendet (Versuch {meta['attempts']}/{self.max_attempts}), "
+            f"nächster Versuch in {delay:.0f}s: {error}"
+        )
+        return meta["next_attempt"]
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending"] = len(list(self.directory.glob("*.json")))
+        stats["failed_pending"] = len(list(self.failed_dir.glob("*.json")))
+        stats["sender"] = self.lock_file is not None
+        stats["connected"] = self.smtp is not None
+        return stats
+
+
+# Singleton-Instanz
+outbox = EmailOutbox()
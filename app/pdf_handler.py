@@ -1,6 +1,8 @@
-import os
-import json
-import smtplib
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -9,138 +11,78 @@ from email.utils import formatdate
 from email import encoders
 import logging
 from datetime import datetime
-from typing import Dict, Optional, Any
+from typing import Optional, Any, List
 
-try:
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    from PyPDF2 import PdfReader, PdfWriter
-except ImportError:
-    logging.warning("PDF-Bibliotheken nicht verfügbar. Installiere sie mit: pip install reportlab PyPDF2")
-
-from .config import EMAIL_SENDER, EMAIL_PASSWORD, EMAIL_RECIPIENT, SMTP_SERVER, SMTP_PORT
+from .config import EMAIL_SENDER, EMAIL_RECIPIENT, PDF_RENDER_WORKERS, RESPONSES_RESUME_INTERVAL
+from .outbox import outbox
+from .response_store import response_store
+# Rendern in eigenem Modul: die Render-Prozesse importieren nur pdf_render, nicht Outbox und Response-Store
+from .pdf_render import build_question_index, init_render_worker, render_pdf
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
 class PDFHandler:
-    def __init__(self):
-        self.template_path = Path("app/data/Template.pdf")
-        self.output_dir = Path("app/data/generated_pdfs")
-        self.output_dir.mkdir(exist_ok=True, parents=True)
-        
-    def generate_pdf(self, responses_file: Path) -> Optional[Path]:
-        """Generiert eine PDF aus den Fragebogen-Antworten"""
-        try:
-            # Lade die Antworten aus der JSON-Datei
-            with open(responses_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            chat_id = data.get("chat_id", "unknown")
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = self.output_dir / f"questionnaire_{chat_id}_{timestamp}.pdf"
-            
-            # Prüfe, ob wir ein Template haben oder eine neue PDF erstellen müssen
-            if self.template_path.exists():
-                self._fill_template_pdf(data, output_file)
-            else:
-                self._create_new_pdf(data, output_file)
-                
-            logger.info(f"PDF erfolgreich erstellt: {output_file}")
-            return output_file
-            
-        except Exception as e:
-            logger.error(f"Fehler bei der PDF-Erstellung: {e}")
-            return None
-            
-    def _fill_template_pdf(self, data: Dict[str, Any], output_file: Path):
-        """Füllt ein PDF-Template mit den Antworten aus"""
-        # Hier würde die Logik zum Ausfüllen eines PDF-Templates stehen
-        # Da wir keine echte Template-Verarbeitung haben, erstellen wir stattdessen eine neue PDF
-        self._create_new_pdf(data, output_file)
-            
-    def _create_new_pdf(self, data: Dict[str, Any], output_file: Path):
-        """Erstellt eine neue PDF mit den Fragebogen-Antworten"""
-        doc = SimpleDocTemplate(str(output_file), pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-        
-        # Titel
-        title_style = styles["Heading1"]
-        title = Paragraph("Product Development Questionnaire", title_style)
-        elements.append(title)
-        elements.append(Spacer(1, 12))
-        
-        # Metadaten
-        elements.append(Paragraph(f"Chat ID: {data.get('chat_id', 'Unknown')}", styles["Normal"]))
-        elements.append(Paragraph(f"Completed: {data.get('end_time', 'Unknown')}", styles["Normal"]))
-        elements.append(Spacer(1, 24))
-        
-        # Antworten nach Abschnitten gruppieren
-        responses = data.get("responses", {})
-        sections = {}
-        
-        # Lade die Fragen, um die Abschnitte zu ermitteln
-        questions_file = Path("app/data/questions.json")
-        if questions_file.exists():
-            with open(questions_file, "r", encoding="utf-8") as f:
-                questions = json.load(f)
-                
-            # Gruppiere Fragen nach Abschnitten
-            for question in questions:
-                qid = question["id"]
-                section = question["section"]
-                text = question["text"]
-                
-                if qid in responses:
-                    if section not in sections:
-                        sections[section] = []
-                    
-                    sections[section].append({
-                        "question": text,
-                        "answer": responses[qid]
-                    })
-        
-        # Füge die Antworten nach Abschnitten sortiert hinzu
-        for section, items in sections.items():
-            # Abschnittsüberschrift
-            section_style = styles["Heading2"]
-            section_title = Paragraph(section, section_style)
-            elements.append(section_title)
-            elements.append(Spacer(1, 6))
-            
-            # Tabelle mit Fragen und Antworten
-            table_data = [["Question", "Answer"]]
-            for item in items:
-                table_data.append([item["question"], item["answer"]])
-                
-            table = Table(table_data, colWidths=[250, 250])
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (1, 0), colors.lightgrey),
-                ('TEXTCOLOR', (0, 0), (1, 0), colors.black),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (1, 0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            elements.append(table)
-            elements.append(Spacer(1, 12))
-        
-        # Erstelle das PDF-Dokument
-        doc.build(elements)
-        
-    def send_email(self, pdf_file: Path) -> bool:
-        """Sendet die PDF per E-Mail"""
+    """Rendert Fragebogen-PDFs in einem begrenzten Prozess-Pool und legt sie in die Outbox.
+
+    Die Prozesse werden per spawn gestartet (kein fork des Webservers mit seinen
+    Threads) und erhalten den Frage-Index einmalig beim Start. Die Anzahl der
+    Prozesse begrenzt zugleich die gleichzeitigen Renderings; weitere warten im Pool.
+    """
+
+    def __init__(self, max_workers: int = PDF_RENDER_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "rendered": 0,
+            "failed": 0,
+            "pending": 0,
+            "total_render_seconds": 0.0,
+            "max_render_seconds": 0.0,
+            "total_wait_seconds": 0.0,
+            "total_pdf_bytes": 0,
+        }
+
+    def start(self, questions: Optional[List[Any]] = None):
+        """Baut den Frage-Index und startet den Pool (nur beim ersten Aufruf)"""
+        with self.lock:
+            self._start_locked(questions)
+
+    def _start_locked(self, questions: Optional[List[Any]] = None):
+        # Aufrufer hält self.lock; nach shutdown() wird kein neuer Pool mehr gestartet
+        if self.closed:
+            raise RuntimeError("PDF-Pool ist bereits beendet")
+        if self.executor is not None:
+            return
+        question_index = build_question_index(questions)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_render_worker,
+            initargs=(question_index,)
+        )
+        logger.info(f"PDF-Pool mit {self.max_workers} Prozessen gestartet ({len(question_index)} Fragen)")
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+            self.closed = True
+        if executor is not None:
+            # Laufende Renderings abschließen, damit keine E-Mail verloren geht
+            executor.shutdown(wait=True)
+
+    def send_email(self, pdf_bytes: bytes, filename: str) -> bool:
+        """Legt die E-Mail mit der PDF in die Outbox; versendet wird im Hintergrund (siehe outbox.py)"""
         try:
             msg = MIMEMultipart()
             msg['From'] = EMAIL_SENDER
             msg['To'] = EMAIL_RECIPIENT
             msg['Date'] = formatdate(localtime=True)
-            msg['Subject'] = f"Product Development Questionnaire - {pdf_file.stem}"
+            msg['Subject'] = f"Product Development Questionnaire - {Path(filename).stem}"
             
             # E-Mail-Text
             body = "Attached is a completed product development questionnaire.\n\n"
@@ -148,61 +90,101 @@ class PDFHandler:
             msg.attach(MIMEText(body))
             
             # PDF-Anhang
-            with open(pdf_file, "rb") as f:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-                
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(pdf_bytes)
             encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename="{pdf_file.name}"')
+            part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
             msg.attach(part)
             
-            # Sende die E-Mail
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.starttls()
-                if EMAIL_PASSWORD:  # Nur anmelden, wenn ein Passwort gesetzt ist
-                    server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-                server.send_message(msg)
-                
-            logger.info(f"E-Mail mit PDF erfolgreich gesendet an {EMAIL_RECIPIENT}")
+            outbox.enqueue(msg)
             return True
             
         except Exception as e:
-            logger.error(f"Fehler beim E-Mail-Versand: {e}")
-            return False
-            
-    def delete_file(self, file_path: Path) -> bool:
-        """Löscht eine Datei"""
-        try:
-            if file_path.exists():
-                file_path.unlink()
-                logger.info(f"Datei gelöscht: {file_path}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"Fehler beim Löschen der Datei {file_path}: {e}")
+            logger.error(f"Fehler beim Einreihen der E-Mail: {e}")
             return False
             
-    def process_questionnaire(self, responses_file: Path) -> bool:
-        """Verarbeitet einen abgeschlossenen Fragebogen"""
-        try:
-            # 1. Generiere PDF
-            pdf_file = self.generate_pdf(responses_file)
-            if not pdf_file:
-                return False
-                
-            # 2. Sende E-Mail
-            email_sent = self.send_email(pdf_file)
-            
-            # 3. Lösche temporäre Dateien
-            self.delete_file(responses_file)
-            if email_sent:
-                self.delete_file(pdf_file)
-                
-            return email_sent
-            
-        except Exception as e:
-            logger.error(f"Fehler bei der Verarbeitung des Fragebogens: {e}")
-            return False
+    def process_questionnaire(self, response_id: int) -> Future:
+        """Rendert die PDF zu einem gespeicherten Fragebogen im Pool und legt die E-Mail in die Outbox.
+
+        Der Fragebogen wird im Response-Store als versendet markiert, sobald die E-Mail dauerhaft
+        in der Outbox liegt. Nach shutdown() wird RuntimeError ausgelöst; der Datensatz bleibt
+        unversendet und wird nach einem Neustart erneut verarbeitet.
+        """
+        data = response_store.get(response_id)
+        if data is None:
+            raise KeyError(f"Fragebogen #{response_id} nicht im Response-Store")
+        chat_id = data.get("chat_id", "unknown")
+        filename = f"questionnaire_{chat_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        submitted_at = time.perf_counter()
+        # Unter dem Lock einreichen: shutdown() kann den Pool sonst zwischen Prüfung und submit beenden
+        with self.lock:
+            self._start_locked()
+            future = self.executor.submit(render_pdf, data)
+            self.stats["submitted"] += 1
+            self.stats["pending"] += 1
+
+        def on_rendered(future: Future):
+            # Läuft im Verwaltungs-Thread des Pools
+            try:
+                pdf_bytes, render_seconds = future.result()
+            except Exception as e:
+                with self.lock:
+                    self.stats["pending"] -= 1
+                    self.stats["failed"] += 1
+                logger.error(f"Fehler bei der PDF-Erstellung für Chat {chat_id}: {e}")
+                return
+
+            with self.lock:
+                self.stats["pending"] -= 1
+                self.stats["rendered"] += 1
+                self.stats["total_render_seconds"] += render_seconds
+                self.stats["max_render_seconds"] = max(self.stats["max_render_seconds"], render_seconds)
+                self.stats["total_wait_seconds"] += time.perf_counter() - submitted_at - render_seconds
+                self.stats["total_pdf_bytes"] += len(pdf_bytes)
+            logger.info(f"PDF für Chat {chat_id} erstellt in {render_seconds:.2f}s ({len(pdf_bytes)} Bytes)")
+
+            if self.send_email(pdf_bytes, filename):
+                response_store.mark_emailed(response_id)
+
+        future.add_done_callback(on_rendered)
+        return future
+
+    def resume_unsent(self) -> int:
+        """Verarbeitet Fragebögen, deren E-Mail nicht in die Outbox kam (Neustart, Renderfehler)"""
+        if self.closed:
+            return 0
+        response_ids = response_store.claim_unsent()
+        for response_id in response_ids:
+            try:
+                self.process_questionnaire(response_id)
+            except RuntimeError as e:
+                # Während des Herunterfahrens: die übrigen bleiben bis RESPONSES_CLAIM_TIMEOUT gesperrt
+                logger.warning(f"Gespeicherte Fragebögen nicht weiter verarbeitet: {e}")
+                break
+        if response_ids:
+            logger.info(f"{len(response_ids)} gespeicherte Fragebögen werden erneut verarbeitet")
+        return len(response_ids)
+
+    async def watch_unsent(self, interval: float = RESPONSES_RESUME_INTERVAL):
+        """Sucht periodisch nach liegen gebliebenen Fragebögen.
+
+        Beim Start sind Fragebögen, die ein abgestürzter Worker kurz vorher übernommen hat,
+        noch gesperrt (RESPONSES_CLAIM_TIMEOUT); sie werden so ohne weiteren Neustart versendet.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.resume_unsent)
+            except Exception as e:
+                logger.error(f"Fehler beim erneuten Verarbeiten gespeicherter Fragebögen: {e}")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["workers"] = self.max_workers
+        stats["avg_render_seconds"] = stats["total_render_seconds"] / stats["rendered"] if stats["rendered"] else 0.0
+        stats["avg_wait_seconds"] = stats["total_wait_seconds"] / stats["rendered"] if stats["rendered"] else 0.0
+        return stats
 
 # Singleton-Instanz
 pdf_handler = PDFHandler() 
\ No newline at end of file
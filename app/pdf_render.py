@@ -0,0 +1,313 @@
+import io
+import json
+import re
+import time
+import logging
+from pathlib import Path
+from xml.sax.saxutils import escape
+from typing import Dict, Optional, Any, List, Tuple
+
+try:
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.utils import simpleSplit
+    from reportlab.pdfbase.pdfmetrics import getAscent, stringWidth
+    from PyPDF2 import PdfReader, PdfWriter, PageObject
+    from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
+except ImportError:
+    logging.warning("PDF-Bibliotheken nicht verfügbar. Installiere sie mit: pip install reportlab PyPDF2")
+
+# Läuft in den spawn-Render-Prozessen: keine Importe mit Nebenwirkungen (Outbox, Datenbanken,
+# Threads), nur Rendern im Speicher
+
+TEMPLATE_PATH = Path("app/data/Template.pdf")
+# Zellen der Antworten im Template (Template.pdf hat keine Formularfelder)
+TEMPLATE_FIELDS_PATH = Path("app/data/template_fields.json")
+QUESTIONS_PATH = Path("app/data/questions.json")
+
+# Frage-ID -> (Abschnitt, Fragetext) in Fragebogen-Reihenfolge; pro Render-Prozess einmal gesetzt
+_question_index: Dict[str, Tuple[str, str]] = {}
+# Vorbereitete Template-Seiten und Feld-Layout; pro Render-Prozess einmal geladen
+_template: Optional[Tuple[list, dict]] = None
+# Name des Overlays (Form-XObject) in den Ressourcen der Seite
+OVERLAY_NAME = "/AnswerOverlay"
+
+
+def build_question_index(questions: Optional[List[Any]] = None) -> Dict[str, Tuple[str, str]]:
+    """Erstellt den Index aus Question-Objekten oder, ohne Angabe, aus questions.json"""
+    if questions is None:
+        if not QUESTIONS_PATH.exists():
+            return {}
+        with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+            return {q["id"]: (q["section"], q["text"]) for q in json.load(f)}
+    return {q.id: (q.section, q.text) for q in questions}
+
+
+def init_render_worker(question_index: Dict[str, Tuple[str, str]]):
+    global _question_index
+    _question_index = question_index
+
+
+def render_pdf(data: Dict[str, Any]) -> Tuple[bytes, float]:
+    """Rendert die Antworten im Speicher; gibt die PDF-Bytes und die Renderdauer zurück"""
+    started = time.perf_counter()
+    buffer = io.BytesIO()
+    if TEMPLATE_PATH.exists():
+        _fill_template_pdf(data, buffer)
+    else:
+        _create_new_pdf(data, buffer)
+    return buffer.getvalue(), time.perf_counter() - started
+
+
+def _load_template() -> Tuple[list, dict]:
+    """Parst Template.pdf und das Feld-Layout beim ersten Aufruf und hält beides im Speicher.
+
+    Jede Seite wird einmal auf eine leere Seite gemergt und ihr Inhalt als fertiger Stream
+    gespeichert; pro Fragebogen wird nur noch das Overlay angehängt (siehe _stamp_overlay),
+    der Template-Inhalt wird nicht erneut geparst.
+    """
+    global _template
+    if _template is None:
+        reader = PdfReader(str(TEMPLATE_PATH))
+        with open(TEMPLATE_FIELDS_PATH, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+        pages = []
+        for page in reader.pages:
+            merged = PageObject.create_blank_page(width=page.mediabox.width, height=page.mediabox.height)
+            merged.merge_page(page)
+            content = DecodedStreamObject()
+            content.set_data(merged.get_contents().get_data())
+            merged[NameObject("/Contents")] = content
+            pages.append(merged)
+        _template = (pages, layout)
+    return _template
+
+
+def _stamp_overlay(writer, page, overlay_page):
+    """Legt die Overlay-Seite als Form-XObject über eine Template-Seite im Writer.
+
+    Das XObject bringt eigene Ressourcen mit, sodass sich Schriftnamen von Overlay und
+    Template nicht in die Quere kommen; der Template-Inhalt bleibt unangetastet.
+    """
+    form = DecodedStreamObject()
+    form.set_data(overlay_page.get_contents().get_data())
+    form.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/BBox"): ArrayObject(overlay_page.mediabox),
+        NameObject("/Resources"): overlay_page["/Resources"].get_object().clone(writer),
+    })
+
+    resources = page["/Resources"].get_object()
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        xobjects = resources[NameObject("/XObject")] = DictionaryObject()
+    xobjects.get_object()[NameObject(OVERLAY_NAME)] = writer._add_object(form)
+
+    stamp = DecodedStreamObject()
+    stamp.set_data(f"q {OVERLAY_NAME} Do Q".encode("ascii"))
+    page[NameObject("/Contents")] = ArrayObject([
+        writer._add_object(page["/Contents"].get_object()),
+        writer._add_object(stamp),
+    ])
+
+
+# Trennzeichen zwischen mehreren gewählten Optionen in einer Textantwort
+_OPTION_SEPARATOR = re.compile(r"[,;]|\band\b")
+
+
+def _normalize_option(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def _fit_text(text: str, layout: dict, width: float, height: float) -> Tuple[List[str], float, float, bool]:
+    """Umbricht den Text auf die Zellenbreite und verkleinert die Schrift bis min_font_size, bis er passt.
+
+    Gibt Zeilen, Schriftgröße, Zeilenabstand und ob der Text vollständig passt zurück;
+    passt er auch in der kleinsten Größe nicht, wird er mit "…" abgeschnitten.
+    """
+    font = layout["font"]
+    size = layout["font_size"]
+    while True:
+        line_height = layout["line_height"] * size / layout["font_size"]
+        max_lines = max(1, 1 + int((height - size) // line_height))
+        lines = simpleSplit(text, font, size, width)
+        fits = len(lines) <= max_lines and all(stringWidth(line, font, size) <= width for line in lines)
+        if fits or size <= layout["min_font_size"]:
+            break
+        size = max(layout["min_font_size"], size - 0.5)
+
+    if not fits:
+        lines = lines[:max_lines]
+        # Zu lange Wörter und die letzte Zeile auf die Breite kürzen
+        for i, line in enumerate(lines):
+            last = i == len(lines) - 1
+            while line and stringWidth(line + ("…" if last else ""), font, size) > width:
+                line = line[:-1]
+            lines[i] = line
+        lines[-1] = lines[-1].rstrip() + "…"
+    return lines, size, line_height, fits
+
+
+def _split_options(answer: str) -> List[Tuple[str, str]]:
+    """Zerlegt eine Antwort an ",", ";" und "and" in (Teil, folgendes Trennzeichen) im Originalwortlaut"""
+    parts, start = [], 0
+    for match in _OPTION_SEPARATOR.finditer(answer):
+        parts.append((answer[start:match.start()], match.group()))
+        start = match.end()
+    parts.append((answer[start:], ""))
+    return parts
+
+
+def _draw_field(pdf, field: dict, answer: Any, layout: dict) -> bool:
+    """Kreuzt passende Checkboxen an und schreibt den übrigen Text in die Zelle des Feldes.
+
+    Vom Text werden nur die angekreuzten Optionen entfernt; der Rest bleibt im Wortlaut
+    des Kunden. Gibt False zurück, wenn die Antwort nicht vollständig im Template steht
+    (abgeschnitten oder ohne Zelle); sie wird dann zusätzlich im Anhang aufgeführt.
+    """
+    answer = str(answer).strip()
+    checkboxes = {_normalize_option(option): position for option, position in field.get("checkboxes", {}).items()}
+
+    ticked = []
+    if not checkboxes:
+        text = answer
+    elif _normalize_option(answer) in checkboxes:
+        ticked.append(checkboxes[_normalize_option(answer)])
+        text = ""
+    else:
+        kept = []
+        for part, separator in _split_options(answer):
+            position = checkboxes.get(_normalize_option(part))
+            if position is None:
+                kept.append((part, separator))
+            else:
+                ticked.append(position)
+        # Teile mit ihren ursprünglichen Trennzeichen wieder aneinanderhängen, ohne das letzte
+        text = "".join(part + separator for part, separator in kept[:-1])
+        text = (text + kept[-1][0] if kept else text).strip(" ,;")
+    if text and "other" in field:
+        ticked.append(field["other"])
+    pdf.setFont("Helvetica-Bold", layout["font_size"])
+    for x, y in ticked:
+        pdf.drawString(x + 1.3, y + 0.7, "X")
+
+    if not text:
+        return True
+    if "box" not in field:
+        return False
+    x0, y0, x1, y1 = field["box"]
+    padding = layout["padding"]
+    lines, size, line_height, fits = _fit_text(text, layout, x1 - x0 - 2 * padding, y1 - y0 - 2 * padding)
+
+    # Auf die Zelle beschneiden, damit nichts über Linien oder Beschriftungen läuft
+    pdf.saveState()
+    clip = pdf.beginPath()
+    clip.rect(x0, y0, x1 - x0, y1 - y0)
+    pdf.clipPath(clip, stroke=0, fill=0)
+    pdf.setFont(layout["font"], size)
+    baseline = y1 - padding - getAscent(layout["font"], size)
+    for i, line in enumerate(lines):
+        pdf.drawString(x0 + padding, baseline - i * line_height, line)
+    pdf.restoreState()
+    return fits
+
+
+def _fill_template_pdf(data: Dict[str, Any], output):
+    """Füllt Template.pdf: die Antworten werden als Overlay gezeichnet und auf die gecachten Seiten gelegt"""
+    pages, layout = _load_template()
+    fields = layout["fields"]
+    responses = data.get("responses", {})
+    # Antworten ohne Zelle im Template und solche, die nicht in ihre Zelle passen, folgen vollständig im Anhang
+    appendix = {qid: answer for qid, answer in responses.items() if qid not in fields}
+
+    overlay_buffer = io.BytesIO()
+    media_box = pages[0].mediabox
+    pdf = canvas.Canvas(overlay_buffer, pagesize=(float(media_box.width), float(media_box.height)))
+    for page_number in range(len(pages)):
+        for qid, field in fields.items():
+            if field["page"] == page_number and responses.get(qid):
+                if not _draw_field(pdf, field, responses[qid], layout):
+                    appendix[qid] = responses[qid]
+        if page_number == 0:
+            pdf.setFont(layout["font"], 6)
+            pdf.drawString(23, 20, f"Chat ID: {data.get('chat_id', 'Unknown')} · Completed: {data.get('end_time', 'Unknown')}")
+        pdf.showPage()
+    pdf.save()
+    overlay = PdfReader(overlay_buffer)
+
+    writer = PdfWriter()
+    for page, overlay_page in zip(pages, overlay.pages):
+        # add_page kopiert die gecachte Seite in den Writer; nur die Kopie wird verändert
+        _stamp_overlay(writer, writer.add_page(page), overlay_page)
+
+    if appendix:
+        summary = io.BytesIO()
+        _create_new_pdf(dict(data, responses=appendix), summary)
+        for page in PdfReader(summary).pages:
+            writer.add_page(page)
+
+    writer.write(output)
+
+
+def _create_new_pdf(data: Dict[str, Any], output):
+    """Erstellt eine neue PDF mit den Fragebogen-Antworten"""
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = []
+    
+    # Titel
+    title_style = styles["Heading1"]
+    title = Paragraph("Product Development Questionnaire", title_style)
+    elements.append(title)
+    elements.append(Spacer(1, 12))
+    
+    # Metadaten
+    elements.append(Paragraph(f"Chat ID: {data.get('chat_id', 'Unknown')}", styles["Normal"]))
+    elements.append(Paragraph(f"Completed: {data.get('end_time', 'Unknown')}", styles["Normal"]))
+    elements.append(Spacer(1, 24))
+    
+    # Antworten nach Abschnitten gruppieren (Reihenfolge wie im Fragebogen)
+    responses = data.get("responses", {})
+    sections = {}
+    for qid, (section, text) in _question_index.items():
+        if qid in responses:
+            sections.setdefault(section, []).append({
+                "question": text,
+                "answer": responses[qid]
+            })
+    
+    # Füge die Antworten nach Abschnitten sortiert hinzu
+    for section, items in sections.items():
+        # Abschnittsüberschrift
+        section_style = styles["Heading2"]
+        section_title = Paragraph(section, section_style)
+        elements.append(section_title)
+        elements.append(Spacer(1, 6))
+        
+        # Tabelle mit Fragen und Antworten
+        table_data = [["Question", "Answer"]]
+        for item in items:
+            # Als Paragraph, damit lange Antworten in der Zelle umbrechen
+            table_data.append([Paragraph(escape(item["question"]), styles["Normal"]),
+                               Paragraph(escape(str(item["answer"])), styles["Normal"])])
+            
+        table = Table(table_data, colWidths=[250, 250])
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (1, 0), colors.lightgrey),
+            ('TEXTCOLOR', (0, 0), (1, 0), colors.black),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('FONTNAME', (0, 0), (1, 0), 'Helvetica-Bold'),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        
+        elements.append(table)
+        elements.append(Spacer(1, 12))
+    
+    # Erstelle das PDF-Dokument
+    doc.build(elements)
@@ -0,0 +1,125 @@
+import threading
+import logging
+from functools import lru_cache
+from typing import List, Tuple
+
+from . import llm
+from .llm import SYSTEM_PROMPT
+from .config import PROMPT_CONTEXT_TOKENS, PROMPT_MIN_CHUNK_TOKENS, PROMPT_DEDUPE_OVERLAP, PROMPT_QUESTION_TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+def count_tokens(text: str) -> int:
+    """Zählt Tokens mit dem geladenen Tokenizer (grobe Schätzung, solange er fehlt)"""
+    if llm.tokenizer is None:
+        return max(1, len(text) // 4)
+    return len(llm.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+@lru_cache(maxsize=4096)
+def _count_chunk_tokens(text: str, exact: bool) -> int:
+    # Abschnitte wiederholen sich ständig; exact trennt Schätzungen von echten Zählungen
+    return count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Kürzt einen Text auf höchstens max_tokens Tokens"""
+    if llm.tokenizer is None:
+        return text[:max_tokens * 4]
+    ids = llm.tokenizer(text, add_special_tokens=False)["input_ids"][:max_tokens]
+    return llm.tokenizer.decode(ids, skip_special_tokens=True)
+
+
+def _is_duplicate(words: set, selected: List[set]) -> bool:
+    # Überlappung relativ zum kleineren Abschnitt, damit enthaltene Abschnitte erkannt werden
+    for other in selected:
+        smaller = min(len(words), len(other))
+        if smaller and len(words & other) / smaller >= PROMPT_DEDUPE_OVERLAP:
+            return True
+    return False
+
+
+class PromptBuilder:
+    """Baut den Chat-Prompt und packt die Kontext-Abschnitte in ein festes Token-Budget"""
+
+    def __init__(self, context_tokens: int = PROMPT_CONTEXT_TOKENS, question_tokens: int = PROMPT_QUESTION_TOKENS):
+        self.context_tokens = context_tokens
+        self.question_tokens = question_tokens
+        self.lock = threading.Lock()
+        self.stats = {"prompts": 0, "prompt_tokens": 0, "max_prompt_tokens": 0, "questions_truncated": 0,
+                      "chunks_used": 0, "chunks_deduplicated": 0, "chunks_dropped": 0, "chunks_truncated": 0}
+
+    def pack_context(self, chunks: List[Tuple[dict, float]]) -> Tuple[List[str], dict]:
+        """Wählt Abschnitte in Score-Reihenfolge (wie von der Suche geliefert) bis das Budget erschöpft ist"""
+        info = {"context_tokens": 0, "chunks_used": 0, "chunks_deduplicated": 0,
+                "chunks_dropped": 0, "chunks_truncated": 0}
+        selected_texts, selected_words = [], []
+        remaining = self.context_tokens
+
+        for entry, _ in chunks:
+            text = entry["text"].strip()
+            words = set(text.lower().split())
+            if _is_duplicate(words, selected_words):
+                info["chunks_deduplicated"] += 1
+                continue
+
+            tokens = _count_chunk_tokens(text, llm.tokenizer is not None)
+            if tokens > remaining:
+                if remaining < PROMPT_MIN_CHUNK_TOKENS:
+                    info["chunks_dropped"] += 1
+                    continue
+                text = truncate_to_tokens(text, remaining)
+                tokens = remaining
+                info["chunks_truncated"] += 1
+
+            selected_texts.append(text)
+            selected_words.append(words)
+            remaining -= tokens
+            info["context_tokens"] += tokens
+            info["chunks_used"] += 1
+
+        return selected_texts, info
+
+    def build(self, question: str, chunks: List[Tuple[dict, float]]) -> Tuple[str, dict]:
+        """Gibt den Prompt und die Token-Statistik dieser Anfrage zurück; die Frage wird auf question_tokens gekürzt"""
+        context_texts, info = self.pack_context(chunks)
+        question = question.strip()
+        info["question_truncated"] = count_tokens(question) > self.question_tokens
+        if info["question_truncated"]:
+            question = truncate_to_tokens(question, self.question_tokens)
+        context_snippet = "\n\n".join(context_texts)
+        prompt = (
+            SYSTEM_PROMPT +
+            "### Relevant company texts:\n"
+            f"{context_snippet}\n\n"
+            "### Question:\n"
+            f"{question}\n\n"
+            "### Answer:"
+        )
+        info["prompt_tokens"] = count_tokens(prompt)
+        logger.info(
+            f"Prompt: {info['prompt_tokens']} Tokens, Kontext {info['context_tokens']} Tokens "
+            f"aus {info['chunks_used']} Abschnitten"
+        )
+
+        with self.lock:
+            self.stats["prompts"] += 1
+            self.stats["prompt_tokens"] += info["prompt_tokens"]
+            self.stats["max_prompt_tokens"] = max(self.stats["max_prompt_tokens"], info["prompt_tokens"])
+            self.stats["questions_truncated"] += info["question_truncated"]
+            for key in ("chunks_used", "chunks_deduplicated", "chunks_dropped", "chunks_truncated"):
+                self.stats[key] += info[key]
+        return prompt, info
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["context_budget"] = self.context_tokens
+        stats["question_budget"] = self.question_tokens
+        stats["avg_prompt_tokens"] = stats["prompt_tokens"] / stats["prompts"] if stats["prompts"] else 0.0
+        return stats
+
+
+# Singleton-Instanz
+prompt_builder = PromptBuilder()
@@ -1,13 +1,140 @@
-from typing import Dict, List, Optional, Union, Literal
+from typing import Dict, List, Optional, Tuple, Union, Literal
 import json
+import re
 from pathlib import Path
 import datetime
 import logging
+from concurrent.futures import Future
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .sessions import create_session_store
+from .response_store import response_store
 
 # Logger konfigurieren
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Präfix der Callback-Daten der Auswahl-Buttons: q:<Frage-Index>:<Options-Index>
+CALLBACK_PREFIX = "q:"
+
+_MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",),
+         ("jun", "june"), ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"),
+         ("oct", "october"), ("nov", "november"), ("dec", "december")], start=1
+    )
+    for name in names
+}
+_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%m/%d/%Y", "%d.%m.%y", "%m/%d/%y")
+_MONTH_YEAR = re.compile(r"([a-z]+)\.?,?\s+(\d{4})")
+_NUMERIC_MONTH_YEAR = re.compile(r"(\d{1,2})\s*[/.-]\s*(\d{4})")
+_QUARTER_YEAR = re.compile(r"q([1-4])\s*[/-]?\s*(\d{4})|(\d{4})\s*[/-]?\s*q([1-4])")
+_HALF_YEAR = re.compile(r"h([12])\s*[/-]?\s*(\d{4})")
+# "end of 2026", "early Q3 2026", "mid-March 2026"
+_DATE_QUALIFIER = re.compile(r"(beginning of|start of|end of|early|mid|late)[\s-]+(.+)")
+_YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+_NUMBER = re.compile(r"(\d+(?:[.,]\d+)*)\s*([km])?")
+_NUMBER_FILLER = re.compile(r"^(?:approx(?:imately)?\.?|about|around|ca\.?|~)\s*|\s*(?:units?|pcs|pieces)$")
+
+
+def normalize_option(text: str) -> str:
+    """Schlüssel für Options-Vergleiche: Groß-/Kleinschreibung, Leer- und Satzzeichen zählen nicht"""
+    return re.sub(r"[^a-z0-9]+", "", text.lower())
+
+
+def _parse_period(text: str) -> Optional[str]:
+    """Genaues Datum (als YYYY-MM-DD), Monat, Quartal, Halbjahr oder Jahr, optional mit Zusatz wie "end of" """
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            pass
+    match = _MONTH_YEAR.fullmatch(text)
+    if match and match.group(1) in _MONTHS:
+        return f"{match.group(2)}-{_MONTHS[match.group(1)]:02d}"
+    match = _NUMERIC_MONTH_YEAR.fullmatch(text)
+    if match and 1 <= int(match.group(1)) <= 12:
+        return f"{match.group(2)}-{int(match.group(1)):02d}"
+    match = _QUARTER_YEAR.fullmatch(text)
+    if match:
+        quarter, year = (match.group(1), match.group(2)) if match.group(1) else (match.group(4), match.group(3))
+        return f"Q{quarter} {year}"
+    match = _HALF_YEAR.fullmatch(text)
+    if match:
+        return f"H{match.group(1)} {match.group(2)}"
+    if re.fullmatch(r"\d{4}", text):
+        return text
+    match = _DATE_QUALIFIER.fullmatch(text)
+    if match:
+        period = _parse_period(match.group(2).strip())
+        if period is not None:
+            return f"{match.group(1)} {period}"
+    return None
+
+
+def _parse_date(answer: str) -> Tuple[Optional[str], Optional[str]]:
+    """Normalisiert bekannte Datumsangaben; andere Angaben mit Jahreszahl bleiben als Freitext erhalten"""
+    text = " ".join(answer.strip().lower().split())
+    period = _parse_period(text)
+    if period is not None:
+        return period, None
+    # Schätzungen wie "after the summer sale 2026" nicht ablehnen, nur nicht normalisieren
+    if _YEAR.search(text):
+        return answer.strip(), None
+    return None, "Please enter a date such as 2026-03-15, March 2026, Q3/2026 or end of 2026."
+
+
+def _parse_decimal(number: str) -> Optional[float]:
+    """Zahl mit Tausendertrennzeichen und/oder Dezimalzeichen (Punkt oder Komma).
+
+    Ein einzelnes Trennzeichen gilt nur als Tausendertrennzeichen, wenn genau drei Ziffern
+    folgen (10,000 / 1.000); sonst ist es ein Dezimalzeichen (1.5 / 1,5). Bei zwei
+    verschiedenen Trennzeichen ist das letzte das Dezimalzeichen (10,000.5 / 10.000,5).
+    """
+    separators = re.findall(r"[.,]", number)
+    groups = re.split(r"[.,]", number)
+    if not separators:
+        return float(number)
+    if len(set(separators)) == 2:
+        if len(set(separators[:-1])) != 1 or separators[-1] == separators[0]:
+            return None
+        integer_groups, decimals = groups[:-1], groups[-1]
+    elif len(separators) == 1 and len(groups[1]) != 3:
+        integer_groups, decimals = groups[:1], groups[1]
+    else:
+        integer_groups, decimals = groups, ""
+    if len(integer_groups) > 1 and (len(integer_groups[0]) > 3 or any(len(g) != 3 for g in integer_groups[1:])):
+        return None
+    return float("".join(integer_groups) + ("." + decimals if decimals else ""))
+
+
+def _parse_quantity(text: str) -> Optional[int]:
+    match = _NUMBER.fullmatch(text)
+    if not match:
+        return None
+    value = _parse_decimal(match.group(1))
+    if value is None:
+        return None
+    if match.group(2):
+        # 2.5k / 1,5m: Dezimalstellen vor dem Suffix
+        value *= 1000 if match.group(2) == "k" else 1_000_000
+    # Stückzahlen sind ganzzahlig; 1.5 ohne Suffix ist eher ein Tippfehler als eine Menge
+    if value != int(value):
+        return None
+    return int(value)
+
+
+def _parse_number(answer: str) -> Tuple[Optional[str], Optional[str]]:
+    """Menge wie 5000, 10,000, 10k, ca. 2000 units oder ein Bereich 5000-10000"""
+    parts = re.split(r"\s*(?:-|–|\bto\b)\s*", answer.strip().lower())
+    values = [_parse_quantity(_NUMBER_FILLER.sub("", part.strip())) for part in parts]
+    if 1 <= len(values) <= 2 and None not in values:
+        return "-".join(str(value) for value in values), None
+    return None, "Please enter a whole number such as 5000, 10,000, 2.5k or a range like 5000-10000."
+
+
 # Datenmodelle
 class Question:
     def __init__(self, id: str, section: str, text: str, 
@@ -18,6 +145,44 @@ class Question:
         self.text = text
         self.type = type
         self.options = options or []
+        self.compile()  # QuestionnaireManager kompiliert erneut mit dem Index der Frage
+
+    def compile(self, index: int = 0):
+        """Bereitet Nachrichtentext, Inline-Tastatur und Options-Lookup einmalig vor"""
+        self.index = index
+        self.message = f"**{self.section}**\n{self.text}"
+        self.keyboard = None
+        # Normalisierte Option bzw. ihre Nummer (1, 2, ...) -> Option
+        self.option_lookup: Dict[str, str] = {}
+        if self.type == "choice" and self.options:
+            for number, option in enumerate(self.options, start=1):
+                self.option_lookup[normalize_option(option)] = option
+                self.option_lookup.setdefault(str(number), option)
+            # Kurze Optionen nebeneinander, lange untereinander
+            per_row = 2 if max(len(option) for option in self.options) <= 16 else 1
+            buttons = [
+                InlineKeyboardButton(option, callback_data=f"{CALLBACK_PREFIX}{index}:{number}")
+                for number, option in enumerate(self.options)
+            ]
+            self.keyboard = InlineKeyboardMarkup(
+                [buttons[i:i + per_row] for i in range(0, len(buttons), per_row)]
+            )
+
+    def validate(self, answer: str) -> Tuple[Optional[str], Optional[str]]:
+        """Prüft eine Antwort; gibt (normalisierte Antwort, None) oder (None, Fehlermeldung) zurück"""
+        answer = answer.strip()
+        if not answer:
+            return None, "Please enter an answer."
+        if self.type == "choice" and self.options:
+            option = self.option_lookup.get(normalize_option(answer))
+            if option is None:
+                return None, "Please choose one of the options below."
+            return option, None
+        if self.type == "date":
+            return _parse_date(answer)
+        if self.type == "number":
+            return _parse_number(answer)
+        return answer, None
 
     def to_dict(self):
         return {
@@ -42,7 +207,11 @@ class QuestionnaireManager:
     def __init__(self):
         self.questions = []
         self._load_questions()
-        self.active_sessions = {}  # chat_id -> {current_index, responses}
+        for index, question in enumerate(self.questions):
+            question.compile(index)
+        self.stats = {"answers": 0, "rejected": 0, "button_answers": 0, "stale_buttons": 0, "completed": 0}
+        # chat_id -> {current_index, responses}; übersteht Neustarts (siehe sessions.py)
+        self.active_sessions = create_session_store()
     
     def _load_questions(self) -> List[Question]:
         """Lädt die Fragebogen-Definitionen aus der JSON-Datei"""
@@ -104,84 +273,119 @@ class QuestionnaireManager:
             "responses": {},
             "start_time": datetime.datetime.now().isoformat()
         }
+        # Sofort schreiben, damit andere Worker den laufenden Fragebogen sehen
+        self.active_sessions.flush([chat_id])
         
         return self.questions[0]
     
-    def get_next_question(self, chat_id: int, response: str) -> Optional[Question]:
-        """Speichert die aktuelle Antwort und gibt die nächste Frage zurück"""
-        if chat_id not in self.active_sessions:
-            return None
-            
-        session = self.active_sessions[chat_id]
-        current_index = session["current_index"]
-        
-        # Speichere die aktuelle Antwort
-        current_question = self.questions[current_index]
-        session["responses"][current_question.id] = response
-        
-        # Gehe zur nächsten Frage
-        next_index = current_index + 1
-        if next_index >= len(self.questions):
-            # Fragebogen ist abgeschlossen
-            response_file = self._save_responses(chat_id)
-            if response_file:
-                # Starte den PDF-Erstellungs- und E-Mail-Versandprozess
-                self._process_completed_questionnaire(response_file)
-            return None
-            
-        session["current_index"] = next_index
-        return self.questions[next_index]
-    
-    def _save_responses(self, chat_id: int) -> Optional[Path]:
-        """Speichert die Antworten des Fragebogens und gibt den Dateipfad zurück"""
-        if chat_id not in self.active_sessions:
-            return None
-            
-        session = self.active_sessions[chat_id]
-        
-        # Erstelle Verzeichnis, falls es nicht existiert
-        responses_dir = Path("app/data/responses")
-        responses_dir.mkdir(exist_ok=True, parents=True)
-        
-        # Speichere die Antworten in einer JSON-Datei mit Zeitstempel
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"responses_{chat_id}_{timestamp}.json"
-        file_path = responses_dir / filename
-        
+    def cancel_questionnaire(self, chat_id: int) -> bool:
+        """Bricht den Fragebogen ab; gibt False zurück, wenn keiner lief"""
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump({
-                    "chat_id": chat_id,
-                    "start_time": session["start_time"],
-                    "end_time": datetime.datetime.now().isoformat(),
-                    "responses": session["responses"]
-                }, f, indent=2)
-            
-            # Entferne die Session
             del self.active_sessions[chat_id]
+        except KeyError:
+            return False
+        self.active_sessions.flush([chat_id])
+        return True
+    
+    def submit_answer(self, chat_id: int, response: str,
+                      question_index: Optional[int] = None) -> Tuple[Optional[Question], Optional[str]]:
+        """Prüft und speichert die Antwort auf die aktuelle Frage.
+
+        Gibt (nächste Frage, None) zurück, (None, None) wenn der Fragebogen abgeschlossen ist,
+        oder (aktuelle Frage, Fehlermeldung), wenn die Antwort abgelehnt wurde. question_index
+        (von einem Button) muss der aktuellen Frage entsprechen, sonst gilt der Button als veraltet.
+        Löst KeyError aus, wenn für den Chat kein Fragebogen (mehr) läuft.
+
+        Die Session wird per compare_and_set geschrieben: verarbeiten mehrere Worker gleichzeitig
+        Antworten desselben Chats, wird die unterlegene Antwort mit dem neuen Stand erneut geprüft.
+        Gelesen wird zuerst aus dem Cache; erst ein Konflikt oder eine Ablehnung liest neu aus der
+        Datenbank. Schreibt synchron, daher aus dem Event-Loop per asyncio.to_thread aufrufen.
+        """
+        fresh = False
+        attempts = 0
+        while attempts < 3:
+            session = self.active_sessions.load(chat_id, fresh=fresh)
+            if session is None:
+                if fresh:
+                    raise KeyError(chat_id)
+                fresh = True
+                continue
+            expected = {"start_time": session["start_time"], "current_index": session["current_index"]}
+            current_index = session["current_index"]
+            current_question = self.questions[current_index]
+            if question_index is not None and question_index != current_index:
+                if not fresh:
+                    fresh = True
+                    continue
+                self.stats["stale_buttons"] += 1
+                return current_question, "That question has already been answered."
             
-            logger.info(f"Antworten gespeichert in {file_path}")
-            return file_path
+            value, error = current_question.validate(response)
+            if error:
+                if not fresh:
+                    # Abgelehnt gegen einen womöglich veralteten Stand: mit der aktuellen Frage prüfen
+                    fresh = True
+                    continue
+                self.stats["rejected"] += 1
+                return current_question, error
             
-        except Exception as e:
-            logger.error(f"Fehler beim Speichern der Antworten: {e}")
-            return None
+            # Speichere die aktuelle Antwort
+            session["responses"][current_question.id] = value
+            
+            # Gehe zur nächsten Frage
+            next_index = current_index + 1
+            if next_index >= len(self.questions):
+                # Fragebogen ist abgeschlossen
+                if self.active_sessions.compare_and_set(chat_id, expected, None):
+                    self._count_answer(question_index)
+                    self._complete_questionnaire(chat_id, session)
+                    return None, None
+            else:
+                session["current_index"] = next_index
+                if self.active_sessions.compare_and_set(chat_id, expected, session):
+                    self._count_answer(question_index)
+                    return self.questions[next_index], None
+            attempts += 1
+            fresh = True
+        
+        # Dauerhafter Konflikt: die Antwort nicht speichern, der Nutzer soll es erneut versuchen
+        session = self.active_sessions.load(chat_id, fresh=True)
+        if session is None:
+            raise KeyError(chat_id)
+        return self.questions[session["current_index"]], "Please send your answer again."
     
-    def _process_completed_questionnaire(self, response_file: Path):
-        """Verarbeitet einen abgeschlossenen Fragebogen (PDF-Erstellung und E-Mail-Versand)"""
+    def _count_answer(self, question_index: Optional[int]):
+        self.stats["answers"] += 1
+        if question_index is not None:
+            self.stats["button_answers"] += 1
+    
+    def _complete_questionnaire(self, chat_id: int, session: dict):
+        """Übergibt die Antworten der (bereits entfernten) Session an den Response-Store.
+
+        Nach dem Commit startet die PDF-Erstellung mit dem E-Mail-Versand.
+        """
+        data = {
+            "chat_id": chat_id,
+            "start_time": session["start_time"],
+            "end_time": datetime.datetime.now().isoformat(),
+            "responses": session["responses"]
+        }
+        # Wie bei den Sessions wird gebündelt im Hintergrund geschrieben
+        future = response_store.append(data)
+        self.stats["completed"] += 1
+        future.add_done_callback(self._process_completed_questionnaire)
+    
+    def _process_completed_questionnaire(self, future: Future):
+        """Verarbeitet einen gespeicherten Fragebogen (PDF-Erstellung und E-Mail-Versand)"""
         try:
+            response_id = future.result()
             # Importiere den PDF-Handler erst hier, um zirkuläre Importe zu vermeiden
             from .pdf_handler import pdf_handler
             
-            # Starte die Verarbeitung asynchron
-            import threading
-            thread = threading.Thread(
-                target=pdf_handler.process_questionnaire,
-                args=(response_file,)
-            )
-            thread.start()
+            # Rendert im Prozess-Pool; die Daten liest der PDF-Handler aus dem Response-Store
+            pdf_handler.process_questionnaire(response_id)
             
-            logger.info(f"PDF-Erstellung und E-Mail-Versand für {response_file} gestartet")
+            logger.info(f"Antworten gespeichert (#{response_id}), PDF-Erstellung und E-Mail-Versand gestartet")
             
         except Exception as e:
             logger.error(f"Fehler bei der Verarbeitung des Fragebogens: {e}")
@@ -189,6 +393,12 @@ class QuestionnaireManager:
     def is_questionnaire_active(self, chat_id: int) -> bool:
         """Prüft, ob ein Fragebogen für den Chat aktiv ist"""
         return chat_id in self.active_sessions
+    
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        submitted = stats["answers"] + stats["rejected"]
+        stats["rejection_rate"] = stats["rejected"] / submitted if submitted else 0.0
+        return stats
 
 # Singleton-Instanz
 questionnaire_manager = QuestionnaireManager() 
\ No newline at end of file
@@ -0,0 +1,214 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import RESPONSES_DB_PATH, RESPONSES_COMMIT_WINDOW_MS, RESPONSES_CLAIM_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseStore:
+    """Abgeschlossene Fragebögen in SQLite (WAL), nur angehängt, nie gelöscht.
+
+    append() legt einen Datensatz in eine Warteschlange; ein Schreib-Thread sammelt alle
+    Datensätze, die innerhalb von RESPONSES_COMMIT_WINDOW_MS eintreffen, und schreibt sie in
+    einer Transaktion mit synchronous=FULL (Group Commit: ein fsync pro Batch statt pro
+    Fragebogen). Das zurückgegebene Future liefert nach dem Commit die ID des Datensatzes.
+    Tag und Art der Produktentwicklung stehen in eigenen, indizierten Spalten für Abfragen
+    und Export. emailed_at markiert Datensätze, deren E-Mail in der Outbox liegt; die übrigen
+    werden nach einem Neustart erneut verarbeitet (claimed_at verhindert doppelte Verarbeitung
+    durch mehrere Worker).
+    """
+
+    def __init__(self, path: str = RESPONSES_DB_PATH, commit_window_ms: int = RESPONSES_COMMIT_WINDOW_MS,
+                 claim_timeout: float = RESPONSES_CLAIM_TIMEOUT):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        self.commit_window = commit_window_ms / 1000
+        self.claim_timeout = claim_timeout
+        self.queue = queue.Queue()
+        self.db_lock = threading.Lock()
+        self.stats = {"appended": 0, "commits": 0, "rows_committed": 0, "max_batch": 0, "commit_errors": 0}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, day TEXT NOT NULL, completed_at TEXT NOT NULL, "
+            "product_development_type TEXT, data TEXT NOT NULL, claimed_at REAL, emailed_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_day ON responses (day)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_type ON responses (product_development_type, day)")
+        self.conn.commit()
+
+        self.writer = threading.Thread(target=self._write_loop, name="response-writer", daemon=True)
+        self.writer.start()
+
+    def append(self, data: Dict[str, Any]) -> Future:
+        """Reiht einen abgeschlossenen Fragebogen zum Schreiben ein; das Future liefert die ID"""
+        completed_at = data.get("end_time") or time.strftime("%Y-%m-%dT%H:%M:%S")
+        row = (
+            data.get("chat_id"),
+            completed_at[:10],
+            completed_at,
+            data.get("responses", {}).get("product_development_type"),
+            json.dumps(data),
+        )
+        future = Future()
+        self.queue.put((row, future))
+        self.stats["appended"] += 1
+        return future
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.commit_window
+            stop = False
+            while True:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: List[tuple]):
+        now = time.time()
+        try:
+            with self.db_lock, self.conn:
+                ids = [
+                    self.conn.execute(
+                        "INSERT INTO responses (chat_id, day, completed_at, product_development_type, data, claimed_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", row + (now,)
+                    ).lastrowid
+                    for row, _ in batch
+                ]
+        except sqlite3.Error as e:
+            self.stats["commit_errors"] += 1
+            logger.error(f"Fehler beim Speichern von {len(batch)} Fragebögen: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.stats["commits"] += 1
+        self.stats["rows_committed"] += len(batch)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        # Erst nach dem Commit melden: die Callbacks starten die PDF-Erstellung
+        for (_, future), response_id in zip(batch, ids):
+            future.set_result(response_id)
+
+    def get(self, response_id: int) -> Optional[Dict[str, Any]]:
+        with self.db_lock:
+            row = self.conn.execute("SELECT data FROM responses WHERE id = ?", (response_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def mark_emailed(self, response_id: int):
+        with self.db_lock, self.conn:
+            self.conn.execute("UPDATE responses SET emailed_at = ? WHERE id = ?", (time.time(), response_id))
+
+    def claim_unsent(self) -> List[int]:
+        """Übernimmt Datensätze ohne E-Mail, deren Verarbeitung abgebrochen ist (z. B. durch einen Neustart)"""
+        now = time.time()
+        with self.db_lock, self.conn:
+            ids = [row[0] for row in self.conn.execute(
+                "SELECT id FROM responses WHERE emailed_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)",
+                (now - self.claim_timeout,)
+            )]
+            # Nur erfolgreich aktualisierte Zeilen gehören diesem Prozess
+            return [
+                response_id for response_id in ids
+                if self.conn.execute(
+                    "UPDATE responses SET claimed_at = ? WHERE id = ? AND emailed_at IS NULL "
+                    "AND (claimed_at IS NULL OR claimed_at < ?)",
+                    (now, response_id, now - self.claim_timeout)
+                ).rowcount
+            ]
+
+    def iter_responses(self, day: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                       product_development_type: Optional[str] = None,
+                       batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Liefert passende Fragebögen in Speicherreihenfolge, seitenweise über die ID gelesen.
+
+        day filtert auf einen Tag (YYYY-MM-DD), since/until auf einen Zeitraum (inklusive).
+        Die Datenbank wird nur pro Seite gesperrt, sodass lange Exporte das Schreiben nicht aufhalten.
+        """
+        conditions, params = ["id > ?"], []
+        if day:
+            conditions.append("day = ?")
+            params.append(day)
+        if since:
+            conditions.append("day >= ?")
+            params.append(since)
+        if until:
+            conditions.append("day <= ?")
+            params.append(until)
+        if product_development_type:
+            conditions.append("product_development_type = ?")
+            params.append(product_development_type)
+        sql = f"SELECT id, data, emailed_at FROM responses WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+
+        last_id = 0
+        while True:
+            with self.db_lock:
+                rows = self.conn.execute(sql, [last_id] + params + [batch_size]).fetchall()
+            for response_id, data, emailed_at in rows:
+                yield dict(json.loads(data), id=response_id, emailed=emailed_at is not None)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def summary(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Anzahl der Fragebögen pro Tag und Art der Produktentwicklung"""
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT day, product_development_type, COUNT(*) FROM responses "
+                "WHERE day >= ? AND day <= ? GROUP BY day, product_development_type ORDER BY day",
+                (since or "", until or "9999")
+            ).fetchall()
+        return [{"day": day, "product_development_type": kind, "count": count} for day, kind, count in rows]
+
+    def stop(self):
+        """Schreibt alle eingereihten Fragebögen und beendet den Schreib-Thread.
+
+        Die Datenbank bleibt offen: die Callbacks starten PDF-Renderings, die nach dem
+        Versand noch mark_emailed aufrufen.
+        """
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(timeout=10)
+
+    def close(self):
+        """Beendet den Schreib-Thread und schließt die Datenbank"""
+        self.stop()
+        with self.db_lock:
+            self.conn.close()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending_writes"] = self.queue.qsize()
+        stats["avg_batch"] = stats["rows_committed"] / stats["commits"] if stats["commits"] else 0.0
+        with self.db_lock:
+            stats["stored"], stats["unsent"] = self.conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(emailed_at) FROM responses"
+            ).fetchone()
+        return stats
+
+
+# Singleton-Instanz
+response_store = ResponseStore()
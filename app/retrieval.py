@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import faiss
+
+from .bm25 import BM25Index, reciprocal_rank_fusion
+from .config import (
+    INDEX_PATH, TEXTS_PATH, INDEX_META_PATH, INDEX_MMAP, INDEX_NPROBE, INDEX_EF_SEARCH,
+    INDEX_RELOAD_INTERVAL, BM25_PATH, RETRIEVAL_HYBRID, RETRIEVAL_RRF_K, RETRIEVAL_FUSION_DEPTH
+)
+
+logger = logging.getLogger(__name__)
+
+
+def load_index(path: str = INDEX_PATH):
+    """Lädt den FAISS-Index (per mmap, damit sich Worker die Seiten teilen) und setzt die Suchparameter"""
+    index = None
+    if INDEX_MMAP:
+        # IO_FLAG_MMAP allein mappt nur IVF-Listen; Flat- und HNSW-Vektoren würden trotzdem in
+        # privaten Speicher kopiert. IO_FLAG_MMAP_IFC (faiss >= 1.8) nutzt die gemappten Seiten
+        # für alle Indextypen direkt.
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            index = faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning(f"Index kann nicht per mmap geladen werden, lade in den Speicher: {e}")
+    if index is None:
+        index = faiss.read_index(path)
+
+    search_params = {}
+    if os.path.exists(INDEX_META_PATH):
+        with open(INDEX_META_PATH, "r", encoding="utf-8") as f:
+            search_params = json.load(f).get("search_params", {})
+    if INDEX_NPROBE:
+        search_params["nprobe"] = int(INDEX_NPROBE)
+    if INDEX_EF_SEARCH:
+        search_params["efSearch"] = int(INDEX_EF_SEARCH)
+
+    parameter_space = faiss.ParameterSpace()
+    for name in ("nprobe", "efSearch"):
+        if name in search_params:
+            try:
+                parameter_space.set_index_parameter(index, name, search_params[name])
+                logger.info(f"Index-Suchparameter {name}={search_params[name]}")
+            except RuntimeError:
+                # Parameter passt nicht zum Index-Typ (z. B. nprobe bei HNSW)
+                pass
+    return index
+
+
+class RetrievalSnapshot:
+    """Unveränderlicher Stand aus Index, BM25-Index (optional) und zugehörigen Texten"""
+
+    def __init__(self, index, texts: list, version: Optional[int], bm25: Optional[BM25Index] = None):
+        self.index = index
+        # Neuere Indizes speichern Inhalts-IDs, ältere nutzen die Position in der Liste
+        self.texts_by_id = {t.get("id", i): t for i, t in enumerate(texts)}
+        self.bm25 = bm25
+        self.version = version
+        self.loaded_at = time.time()
+
+    def dense_search(self, q_emb, k: int) -> List[Tuple[int, float]]:
+        D, I = self.index.search(q_emb, k)
+        # -1 (zu wenige ANN-Treffer) und unbekannte IDs werden übersprungen
+        return [(i, float(d)) for i, d in zip(I[0].tolist(), D[0].tolist()) if i in self.texts_by_id]
+
+    def keyword_search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        return [(i, score) for i, score in self.bm25.search(query, k) if i in self.texts_by_id]
+
+    def search(self, q_emb, k: int) -> List[Tuple[dict, float]]:
+        return [(self.texts_by_id[i], d) for i, d in self.dense_search(q_emb, k)]
+
+    def hybrid_search(self, q_emb, query: str, k: int,
+                      depth: int = RETRIEVAL_FUSION_DEPTH) -> Tuple[List[Tuple[dict, float]], int]:
+        """Fusioniert FAISS- und BM25-Treffer; gibt die Treffer mit RRF-Score (höher = besser) und
+        die Anzahl der Treffer zurück, die nur BM25 gefunden hat"""
+        depth = max(depth, k)
+        dense = [i for i, _ in self.dense_search(q_emb, depth)]
+        keyword = [i for i, _ in self.keyword_search(query, depth)]
+        fused = reciprocal_rank_fusion([dense, keyword], RETRIEVAL_RRF_K)[:k]
+        dense_ids = set(dense)
+        keyword_only = sum(1 for i, _ in fused if i not in dense_ids)
+        return [(self.texts_by_id[i], score) for i, score in fused], keyword_only
+
+
+class Retriever:
+    """Hält den aktuellen RetrievalSnapshot und tauscht ihn bei neuen Index-Dateien aus.
+
+    Der Austausch ist eine einfache Referenzzuweisung: laufende Suchen arbeiten
+    mit dem Snapshot weiter, den sie zu Beginn gelesen haben.
+    """
+
+    def __init__(self, index_path: str = INDEX_PATH, texts_path: str = TEXTS_PATH,
+                 bm25_path: str = BM25_PATH, hybrid: bool = RETRIEVAL_HYBRID):
+        self.index_path = index_path
+        self.texts_path = texts_path
+        self.bm25_path = bm25_path
+        self.hybrid = hybrid
+        self.snapshot: Optional[RetrievalSnapshot] = None
+        self.reload_lock = threading.Lock()
+        self.listeners: List[Callable[[RetrievalSnapshot], None]] = []
+        self.stats = {"reloads": 0, "reload_failures": 0, "last_reload_seconds": 0.0,
+                      "searches": 0, "hybrid_searches": 0, "keyword_only_hits": 0,
+                      "total_search_seconds": 0.0, "max_search_seconds": 0.0}
+
+    def _file_version(self) -> Optional[int]:
+        # build_index.py ersetzt den Index zuletzt, seine Änderungszeit markiert den Stand
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def add_reload_listener(self, listener: Callable[[RetrievalSnapshot], None]):
+        """Registriert einen Callback, der nach jedem Austausch aufgerufen wird"""
+        self.listeners.append(listener)
+
+    def load(self):
+        """Lädt den Index beim Start (nur beim ersten Aufruf)"""
+        if self.snapshot is None:
+            self.reload(force=True)
+
+    def reload(self, force: bool = False) -> bool:
+        """Lädt Index und Texte neu, wenn sich die Dateien geändert haben; gibt True bei Austausch zurück"""
+        with self.reload_lock:
+            version = self._file_version()
+            if not force and self.snapshot is not None and version == self.snapshot.version:
+                return False
+
+            started = time.monotonic()
+            try:
+                index = load_index(self.index_path)
+                with open(self.texts_path, "r", encoding="utf-8") as f:
+                    texts = json.load(f)
+                bm25 = None
+                if self.hybrid:
+                    if os.path.exists(self.bm25_path):
+                        bm25 = BM25Index.load(self.bm25_path)
+                    else:
+                        logger.warning(f"{self.bm25_path} fehlt (scripts/build_index.py ausführen), suche nur per FAISS")
+                snapshot = RetrievalSnapshot(index, texts, version, bm25)
+            except Exception as e:
+                self.stats["reload_failures"] += 1
+                logger.error(f"Fehler beim Laden des Index: {e}")
+                if self.snapshot is None:
+                    raise
+                return False
+
+            self.snapshot = snapshot
+            self.stats["reloads"] += 1
+            self.stats["last_reload_seconds"] = time.monotonic() - started
+            logger.info(f"Index geladen: {len(snapshot.texts_by_id)} Textabschnitte (Version {version})")
+
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Fehler in Reload-Listener: {e}")
+        return True
+
+    def search(self, q_emb, k: int = 3, query: Optional[str] = None) -> List[Tuple[dict, float]]:
+        """Gibt die k passendsten Textabschnitte zurück, bester Treffer zuerst.
+
+        Mit Anfragetext und BM25-Index hybrid (Score = RRF-Score), sonst nur FAISS (Score = Distanz).
+        """
+        snapshot = self.snapshot
+        started = time.perf_counter()
+        if query and snapshot.bm25 is not None:
+            results, keyword_only = snapshot.hybrid_search(q_emb, query, k)
+            self.stats["hybrid_searches"] += 1
+            self.stats["keyword_only_hits"] += keyword_only
+        else:
+            results = snapshot.search(q_emb, k)
+        elapsed = time.perf_counter() - started
+        self.stats["searches"] += 1
+        self.stats["total_search_seconds"] += elapsed
+        self.stats["max_search_seconds"] = max(self.stats["max_search_seconds"], elapsed)
+        return results
+
+    async def watch(self, interval: float = INDEX_RELOAD_INTERVAL):
+        """Prüft periodisch auf einen neuen Index und lädt ihn im Hintergrund"""
+        while True:
+            await asyncio.sleep(interval)
+            snapshot = self.snapshot
+            if snapshot is not None and self._file_version() == snapshot.version:
+                continue
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                logger.error(f"Fehler beim automatischen Neuladen des Index: {e}")
+
+    def get_stats(self) -> dict:
+        snapshot = self.snapshot
+        stats = dict(self.stats)
+        stats["loaded"] = snapshot is not None
+        stats["avg_search_ms"] = stats["total_search_seconds"] / stats["searches"] * 1000 if stats["searches"] else 0.0
+        if snapshot is not None:
+            stats["version"] = snapshot.version
+            stats["loaded_at"] = snapshot.loaded_at
+            stats["texts"] = len(snapshot.texts_by_id)
+            stats["vectors"] = snapshot.index.ntotal
+            stats["bm25_terms"] = len(snapshot.bm25.postings) if snapshot.bm25 is not None else 0
+        return stats
+
+
+# Singleton-Instanz
+retriever = Retriever()
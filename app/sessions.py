@@ -0,0 +1,268 @@
+import json
+import sqlite3
+import threading
+import time
+import logging
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Optional
+
+from .config import SESSION_BACKEND, SESSION_DB_PATH, SESSION_FLUSH_INTERVAL, SESSION_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteSessionStore(MutableMapping):
+    """Fragebogen-Sessions in SQLite (WAL) mit dict als Read-Through-Cache.
+
+    Schreibzugriffe landen sofort im Cache und werden von einem Hintergrund-Thread
+    gesammelt in einer Transaktion geschrieben (Write-Behind). Mit synchronous=NORMAL
+    kostet ein Commit im WAL-Modus kein fsync. Andere Worker sehen Änderungen nach
+    dem nächsten Flush; gecachte Einträge werden nach SESSION_CACHE_TTL neu gelesen.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, flush_interval: float = SESSION_FLUSH_INTERVAL,
+                 cache_ttl: float = SESSION_CACHE_TTL):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.cache = {}  # chat_id -> (session, geladen_um)
+        self.dirty = {}  # chat_id -> JSON oder None (gelöscht)
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stats = {"cache_hits": 0, "db_reads": 0, "flushes": 0, "rows_written": 0,
+                      "cas_writes": 0, "cas_conflicts": 0}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+        self.flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self.flusher.start()
+
+    def _read(self, chat_id):
+        with self.db_lock:
+            row = self.conn.execute("SELECT data FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        self.stats["db_reads"] += 1
+        return json.loads(row[0]) if row else None
+
+    def __getitem__(self, chat_id):
+        with self.lock:
+            if chat_id in self.dirty:
+                if self.dirty[chat_id] is None:
+                    raise KeyError(chat_id)
+                self.stats["cache_hits"] += 1
+                return self.cache[chat_id][0]
+            cached = self.cache.get(chat_id)
+            if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+                self.stats["cache_hits"] += 1
+                return cached[0]
+
+        session = self._read(chat_id)
+        with self.lock:
+            if chat_id in self.dirty:
+                # Während des Lesens lokal geändert, der Cache ist aktueller
+                if self.dirty[chat_id] is None:
+                    raise KeyError(chat_id)
+                return self.cache[chat_id][0]
+            if session is None:
+                self.cache.pop(chat_id, None)
+                raise KeyError(chat_id)
+            self.cache[chat_id] = (session, time.monotonic())
+            return session
+
+    def __setitem__(self, chat_id, session: dict):
+        # Sofort serialisieren, damit spätere Änderungen am dict den Flush nicht stören
+        data = json.dumps(session)
+        with self.lock:
+            self.cache[chat_id] = (session, time.monotonic())
+            self.dirty[chat_id] = data
+
+    def __delitem__(self, chat_id):
+        if chat_id not in self:
+            raise KeyError(chat_id)
+        with self.lock:
+            self.cache.pop(chat_id, None)
+            self.dirty[chat_id] = None
+
+    def __contains__(self, chat_id) -> bool:
+        try:
+            self[chat_id]
+            return True
+        except KeyError:
+            return False
+
+    def load(self, chat_id, fresh: bool = False) -> Optional[dict]:
+        """Eigene Kopie der Session für compare_and_set; fresh liest am Cache vorbei aus der Datenbank.
+
+        Ein veralteter Cache-Eintrag ist hier unkritisch: compare_and_set schlägt dann fehl,
+        und der Aufrufer liest mit fresh=True neu.
+        """
+        if not fresh:
+            try:
+                return json.loads(json.dumps(self[chat_id]))
+            except KeyError:
+                return None
+        self.flush([chat_id])
+        session = self._read(chat_id)
+        with self.lock:
+            # Während des Lesens lokal geänderte Einträge nicht überschreiben
+            if chat_id not in self.dirty:
+                if session is None:
+                    self.cache.pop(chat_id, None)
+                else:
+                    self.cache[chat_id] = (json.loads(json.dumps(session)), time.monotonic())
+        return session
+
+    def compare_and_set(self, chat_id, expected: dict, session: Optional[dict]) -> bool:
+        """Ersetzt (oder löscht, wenn session None ist) die Session nur, wenn in der Datenbank noch
+        derselbe Fragebogen (start_time) bei derselben Frage (current_index) steht wie in expected.
+
+        Schreibt sofort statt gebündelt: mehrere Worker können Antworten desselben Chats
+        verarbeiten, und nur eine Antwort pro Frage darf gewinnen. Eine noch ausstehende
+        Änderung dieses Chats wird in derselben Transaktion vorher geschrieben; die übrigen
+        bleiben dem Flush-Thread überlassen. Blockiert bis zu SQLites busy-Timeout, daher
+        nicht auf dem Event-Loop aufrufen.
+        """
+        with self.lock:
+            pending = self.dirty.pop(chat_id, False)
+        condition = ("chat_id = ? AND json_extract(data, '$.start_time') = ? "
+                     "AND json_extract(data, '$.current_index') = ?")
+        params = (chat_id, expected["start_time"], expected["current_index"])
+        try:
+            with self.db_lock, self.conn:
+                if pending is not False:
+                    self._write_rows({chat_id: pending}, time.time())
+                if session is None:
+                    cursor = self.conn.execute(f"DELETE FROM sessions WHERE {condition}", params)
+                else:
+                    cursor = self.conn.execute(
+                        f"UPDATE sessions SET data = ?, updated_at = ? WHERE {condition}",
+                        (json.dumps(session), time.time()) + params
+                    )
+        except sqlite3.Error:
+            if pending is not False:
+                with self.lock:
+                    self.dirty.setdefault(chat_id, pending)
+            raise
+        swapped = cursor.rowcount == 1
+        with self.lock:
+            if swapped and session is not None:
+                self.cache[chat_id] = (session, time.monotonic())
+            else:
+                self.cache.pop(chat_id, None)
+        self.stats["cas_writes" if swapped else "cas_conflicts"] += 1
+        return swapped
+
+    def __iter__(self):
+        self.flush()
+        with self.db_lock:
+            rows = self.conn.execute("SELECT chat_id FROM sessions").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        self.flush()
+        with self.db_lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _write_rows(self, dirty: dict, now: float):
+        # Aufrufer hält db_lock und die Transaktion
+        self.conn.executemany(
+            "INSERT INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            [(chat_id, data, now) for chat_id, data in dirty.items() if data is not None]
+        )
+        self.conn.executemany(
+            "DELETE FROM sessions WHERE chat_id = ?",
+            [(chat_id,) for chat_id, data in dirty.items() if data is None]
+        )
+
+    def flush(self, chat_ids=None):
+        """Schreibt alle (oder nur die Änderungen der angegebenen Chats) in einer Transaktion"""
+        with self.lock:
+            if chat_ids is None:
+                dirty, self.dirty = self.dirty, {}
+            else:
+                dirty = {chat_id: self.dirty.pop(chat_id) for chat_id in chat_ids if chat_id in self.dirty}
+        if not dirty:
+            return
+
+        try:
+            with self.db_lock, self.conn:
+                self._write_rows(dirty, time.time())
+        except sqlite3.Error as e:
+            logger.error(f"Fehler beim Speichern der Sessions: {e}")
+            with self.lock:
+                # Neuere Änderungen haben Vorrang vor dem fehlgeschlagenen Stand
+                for chat_id, data in dirty.items():
+                    self.dirty.setdefault(chat_id, data)
+            return
+
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(dirty)
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stop_event.set()
+        self.flusher.join(timeout=5)
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats, cached=len(self.cache), pending_writes=len(self.dirty))
+        stats["backend"] = "sqlite"
+        return stats
+
+
+class MemorySessionStore(dict):
+    """Bisheriges Verhalten: Sessions nur im Speicher dieses Prozesses"""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    def load(self, chat_id, fresh: bool = False) -> Optional[dict]:
+        session = self.get(chat_id)
+        return json.loads(json.dumps(session)) if session is not None else None
+
+    def compare_and_set(self, chat_id, expected: dict, session: Optional[dict]) -> bool:
+        with self.lock:
+            current = self.get(chat_id)
+            if (current is None or current["start_time"] != expected["start_time"]
+                    or current["current_index"] != expected["current_index"]):
+                return False
+            if session is None:
+                del self[chat_id]
+            else:
+                self[chat_id] = session
+            return True
+
+    def flush(self, chat_ids=None):
+        pass
+
+    def close(self):
+        pass
+
+    def get_stats(self) -> dict:
+        return {"backend": "memory", "cached": len(self)}
+
+
+def create_session_store():
+    """Erzeugt das konfigurierte Session-Backend (SESSION_BACKEND=sqlite|memory)"""
+    if SESSION_BACKEND == "memory":
+        return MemorySessionStore()
+    if SESSION_BACKEND != "sqlite":
+        raise ValueError(f"Unbekanntes Session-Backend '{SESSION_BACKEND}' (erlaubt: sqlite, memory)")
+    return SQLiteSessionStore()
@@ -0,0 +1,69 @@
+import asyncio
+import inspect
+import time
+import logging
+from typing import Awaitable, Callable, Dict, Union
+
+logger = logging.getLogger(__name__)
+
+
+class StartupPipeline:
+    """Lädt die Komponenten (Embedder, Index, Modell, ...) parallel im Hintergrund.
+
+    Synchrone Loader laufen in eigenen Threads, damit der Server schon Anfragen
+    annimmt, während z. B. das LLM noch geladen wird.
+    """
+
+    def __init__(self):
+        self.loaders: Dict[str, Callable[[], Union[None, Awaitable[None]]]] = {}
+        self.components: Dict[str, dict] = {}
+        self.events: Dict[str, asyncio.Event] = {}
+
+    def add(self, name: str, loader: Callable[[], Union[None, Awaitable[None]]]):
+        """Registriert einen Loader; Koroutinen-Funktionen werden direkt awaited"""
+        self.loaders[name] = loader
+        self.components[name] = {"status": "pending", "seconds": None, "error": None}
+        self.events[name] = asyncio.Event()
+
+    async def _load(self, name: str):
+        loader = self.loaders[name]
+        component = self.components[name]
+        component["status"] = "loading"
+        started = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(loader):
+                await loader()
+            else:
+                await asyncio.to_thread(loader)
+        except Exception as e:
+            component["status"] = "failed"
+            component["error"] = str(e)
+            logger.error(f"Fehler beim Laden von {name}: {e}")
+        else:
+            component["status"] = "ready"
+            logger.info(f"{name} geladen in {time.monotonic() - started:.1f}s")
+        finally:
+            component["seconds"] = round(time.monotonic() - started, 3)
+            self.events[name].set()
+
+    async def run(self):
+        """Startet alle registrierten Loader gleichzeitig"""
+        await asyncio.gather(*(self._load(name) for name in self.loaders))
+
+    def is_ready(self, *names: str) -> bool:
+        return all(self.components.get(name, {}).get("status") == "ready" for name in names)
+
+    async def wait_for(self, name: str) -> bool:
+        """Wartet, bis eine Komponente geladen (oder fehlgeschlagen) ist"""
+        await self.events[name].wait()
+        return self.is_ready(name)
+
+    def get_status(self) -> dict:
+        return {
+            "ready": bool(self.components) and self.is_ready(*self.components),
+            "components": {name: dict(component) for name, component in self.components.items()},
+        }
+
+
+# Singleton-Instanz
+startup = StartupPipeline()
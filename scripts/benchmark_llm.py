@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Vergleicht Inferenz-Backends (Quantisierung) nach Tokens/Sekunde und Speicherbedarf.
+
+Jede Variante läuft in einem eigenen Prozess, damit der gemessene Resident
+Set Size nur das jeweilige Modell enthält:
+
+    LLM_DEVICE=cpu python scripts/benchmark_llm.py --modes none,int8-dynamic
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROMPTS = [
+    "What is Product Society?",
+    "Which services does Product Society offer for product development?",
+    "How can I get in touch with Product Society?",
+    "Describe a typical project with Product Society in a few sentences.",
+]
+
+
+def run_mode(max_new_tokens: int, repeats: int) -> dict:
+    """Lädt das Modell mit der Konfiguration aus der Umgebung und misst die Generierung"""
+    sys.path.insert(0, str(ROOT))
+    from app import llm
+
+    rss_before = llm.resident_memory_mb()
+    llm.init_model()
+    rss_loaded = llm.resident_memory_mb()
+
+    prompts = [llm.SYSTEM_PROMPT + f"Question: {p}\nAnswer:" for p in PROMPTS]
+    # Aufwärmen (erste Aufrufe enthalten Allokationen und Kernel-Auswahl)
+    llm.generate_batch(prompts[:1], 8)
+
+    generated, seconds = 0, 0.0
+    for _ in range(repeats):
+        for prompt in prompts:
+            started = time.perf_counter()
+            _, count, _ = llm.generate_batch([prompt], max_new_tokens)[0]
+            seconds += time.perf_counter() - started
+            generated += count
+
+    return dict(
+        llm.backend_info,
+        rss_mb_model=round(rss_loaded - rss_before),
+        rss_mb_peak=round(llm.resident_memory_mb()),
+        generated_tokens=generated,
+        tokens_per_second=round(generated / seconds, 2) if seconds else 0.0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="none,int8-dynamic",
+                        help="Kommagetrennte LLM_QUANTIZATION-Werte; der erste ist die Referenz")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_mode(args.max_new_tokens, args.repeats)))
+        return
+
+    results = []
+    for mode in args.modes.split(","):
+        print(f"➡️  Messe LLM_QUANTIZATION={mode} …", file=sys.stderr)
+        proc = subprocess.run(
+            [sys.executable, __file__, "--run",
+             "--max-new-tokens", str(args.max_new_tokens), "--repeats", str(args.repeats)],
+            env=dict(os.environ, LLM_QUANTIZATION=mode),
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            print(f"❌ {mode} fehlgeschlagen:\n{proc.stderr[-2000:]}", file=sys.stderr)
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        sys.exit(1)
+
+    baseline = results[0]
+    print(f"{'Quantisierung':<14} {'Gerät':<6} {'dtype':<15} {'Tok/s':>8} {'Speedup':>8} {'RSS MB':>8} {'Modell MB':>10} {'Laden s':>8}")
+    for r in results:
+        speedup = r["tokens_per_second"] / baseline["tokens_per_second"] if baseline["tokens_per_second"] else 0.0
+        print(f"{r['quantization']:<14} {r['device']:<6} {r['dtype']:<15} {r['tokens_per_second']:>8.2f} "
+              f"{speedup:>7.2f}x {r['rss_mb_peak']:>8} {r['rss_mb_model']:>10} {r['load_seconds']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Offline-Benchmark der Suche: Recall@k, MRR und Latenz für FAISS, BM25 und die hybride Fusion.
+
+Die Eval-Datei enthält Anfragen mit Textstellen, die ein relevanter Abschnitt enthalten muss:
+
+    python scripts/build_index.py
+    python scripts/benchmark_retrieval.py --eval app/data/retrieval_eval.json --k 3
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def first_relevant_rank(texts: list, relevant: list) -> int:
+    """Rang (ab 1) des ersten Abschnitts, der eine der Textstellen enthält; 0 = keiner"""
+    needles = [r.lower() for r in relevant]
+    for rank, text in enumerate(texts, start=1):
+        if any(needle in text.lower() for needle in needles):
+            return rank
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eval", default="app/data/retrieval_eval.json")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=50, help="Wiederholungen pro Anfrage für die Latenz")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    from app.embeddings import query_encoder
+    from app.retrieval import retriever
+
+    with open(args.eval, "r", encoding="utf-8") as f:
+        cases = json.load(f)
+    retriever.load()
+    snapshot = retriever.snapshot
+    if snapshot.bm25 is None:
+        print("❌ Kein BM25-Index geladen, zuerst scripts/build_index.py ausführen", file=sys.stderr)
+        sys.exit(1)
+    query_encoder.load()
+    # Embeddings vorab berechnen: gemessen wird nur die Suche
+    embeddings = [query_encoder.encode(case["query"]) for case in cases]
+
+    modes = {
+        "faiss": lambda q_emb, query: [snapshot.texts_by_id[i] for i, _ in snapshot.dense_search(q_emb, args.k)],
+        "bm25": lambda q_emb, query: [snapshot.texts_by_id[i] for i, _ in snapshot.keyword_search(query, args.k)],
+        "hybrid": lambda q_emb, query: [entry for entry, _ in snapshot.hybrid_search(q_emb, query, args.k)[0]],
+    }
+
+    print(f"{len(cases)} Anfragen, {len(snapshot.texts_by_id)} Abschnitte, k={args.k}")
+    print(f"{'Verfahren':<10} {f'Recall@{args.k}':>10} {'MRR':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, search in modes.items():
+        ranks, latencies = [], []
+        for case, q_emb in zip(cases, embeddings):
+            results = search(q_emb, case["query"])
+            ranks.append(first_relevant_rank([entry["text"] for entry in results], case["relevant"]))
+            for _ in range(args.repeats):
+                started = time.perf_counter()
+                search(q_emb, case["query"])
+                latencies.append((time.perf_counter() - started) * 1000)
+        recall = sum(1 for rank in ranks if rank) / len(ranks)
+        mrr = sum(1 / rank for rank in ranks if rank) / len(ranks)
+        print(f"{name:<10} {recall:>10.3f} {mrr:>8.3f} "
+              f"{np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 95):>8.3f}")
+
+        misses = [case["query"] for case, rank in zip(cases, ranks) if not rank]
+        for query in misses:
+            print(f"    ✗ {query}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,144 @@
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 import faiss
+import hashlib
 import json
+import math
 import os
 import sys
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from app.bm25 import build_bm25
+
+# Index-Typ und Parameter (über Umgebungsvariablen einstellbar)
+INDEX_TYPE                 = os.getenv("INDEX_TYPE", "flat").lower()   # flat | ivfpq | hnsw
+INDEX_NLIST                = int(os.getenv("INDEX_NLIST", "0"))         # 0 = automatisch (4 * sqrt(n))
+INDEX_PQ_M                 = int(os.getenv("INDEX_PQ_M", "48"))
+INDEX_PQ_NBITS             = int(os.getenv("INDEX_PQ_NBITS", "8"))
+INDEX_HNSW_M               = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", "200"))
+INDEX_TARGET_RECALL        = float(os.getenv("INDEX_TARGET_RECALL", "0.95"))
+# Erzwingt einen vollständigen Neuaufbau statt eines inkrementellen Updates
+INDEX_FULL_REBUILD         = os.getenv("INDEX_FULL_REBUILD", "false").lower() in ("1", "true", "yes")
+
+
+def chunk_id(meta: str, text: str):
+    """Gibt den Inhalts-Hash eines Abschnitts und die daraus abgeleitete FAISS-ID zurück"""
+    digest = hashlib.sha256(f"{meta}\0{text}".encode("utf-8")).hexdigest()
+    # 60 Bit, damit die ID sicher in einen positiven int64 passt
+    return digest, int(digest[:15], 16)
+
+
+def load_embedding_cache(path: Path) -> dict:
+    """Lädt die Embeddings früherer Läufe (ID -> Vektor)"""
+    if not path.exists():
+        return {}
+    with open(path, "rb") as f:
+        data = np.load(f)
+        return dict(zip(data["ids"].tolist(), data["embeddings"]))
+
+
+def save_embedding_cache(path: Path, ids: list, embeddings: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, ids=np.asarray(ids, dtype=np.int64), embeddings=embeddings)
+    os.replace(tmp_path, path)
+
+
+def write_atomic(path: Path, write):
+    """Schreibt über eine temporäre Datei, damit Leser nie eine halbe Datei sehen"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_existing_index(index_path: Path, meta_path: Path, dim: int):
+    """Lädt den bisherigen Index, wenn er inkrementell aktualisiert werden kann"""
+    if INDEX_FULL_REBUILD or not index_path.exists() or not meta_path.exists():
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    # HNSW unterstützt kein Entfernen, dort wird aus dem Embedding-Cache neu aufgebaut
+    if not meta.get("id_mapped") or meta.get("type") != INDEX_TYPE or INDEX_TYPE == "hnsw":
+        return None
+    if meta.get("dimension") != dim:
+        return None
+    return faiss.read_index(str(index_path))
+
+
+def build_faiss_index(embeddings: np.ndarray, ids: np.ndarray, index_type: str):
+    """Erstellt (und trainiert) den gewünschten FAISS-Index; gibt Index und tatsächlichen Typ zurück.
+
+    Die Vektoren werden unter ihren Inhalts-IDs abgelegt, damit spätere Läufe
+    einzelne Abschnitte entfernen oder ergänzen können.
+    """
+    n, dim = embeddings.shape
+
+    if index_type == "ivfpq":
+        nlist = INDEX_NLIST or max(1, int(4 * math.sqrt(n)))
+        if dim % INDEX_PQ_M != 0:
+            print(f"❌ INDEX_PQ_M={INDEX_PQ_M} muss die Dimension {dim} teilen!", file=sys.stderr)
+            sys.exit(1)
+        # k-means braucht mindestens so viele Punkte wie Zentroiden
+        min_points = max(nlist, 2 ** INDEX_PQ_NBITS)
+        if n < min_points:
+            print(f"⚠️  Zu wenige Textabschnitte ({n} < {min_points}) für IVF-PQ, verwende Flat-Index.")
+            return build_faiss_index(embeddings, ids, "flat")
+        print(f"🏋️  Trainiere IVF-PQ (nlist={nlist}, m={INDEX_PQ_M}, nbits={INDEX_PQ_NBITS})...")
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, INDEX_PQ_M, INDEX_PQ_NBITS)
+        index.train(embeddings)
+        index.add_with_ids(embeddings, ids)
+        return index, "ivfpq"
+
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, INDEX_HNSW_M)
+        hnsw.hnsw.efConstruction = INDEX_HNSW_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+        index.add_with_ids(embeddings, ids)
+        return index, "hnsw"
+
+    if index_type != "flat":
+        print(f"❌ Unbekannter INDEX_TYPE '{index_type}' (erlaubt: flat, ivfpq, hnsw)", file=sys.stderr)
+        sys.exit(1)
+
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    index.add_with_ids(embeddings, ids)
+    return index, "flat"
+
+
+def tune_search_params(index, index_type: str, embeddings: np.ndarray, ids: np.ndarray, k: int = 10) -> dict:
+    """Wählt den kleinsten nprobe/efSearch, der die Ziel-Recall gegenüber der exakten Suche erreicht"""
+    if index_type == "ivfpq":
+        nlist = faiss.extract_index_ivf(index).nlist
+        param, candidates = "nprobe", [n for n in (1, 2, 4, 8, 16, 32, 64, 128, 256) if n <= nlist] or [nlist]
+    elif index_type == "hnsw":
+        # IndexIDMap2 um IndexHNSWFlat: kein nlist
+        param, candidates = "efSearch", [16, 32, 64, 128, 256, 512]
+    else:
+        return {}
+
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), size=min(200, len(embeddings)), replace=False)]
+    k = min(k, len(embeddings))
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, positions = exact.search(queries, k)
+    truth = ids[positions]
+
+    params = faiss.ParameterSpace()
+    recall = 0.0
+    for value in candidates:
+        params.set_index_parameter(index, param, value)
+        _, found = index.search(queries, k)
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        print(f"  {param}={value}: Recall@{k}={recall:.3f}")
+        if recall >= INDEX_TARGET_RECALL:
+            break
+    return {param: value, "recall_at_k": float(recall), "k": k}
+
 
 def main():
     # Prüfe, ob das Datenverzeichnis existiert
@@ -18,37 +153,100 @@ def main():
         print(f"❌ Keine Markdown-Dateien im Verzeichnis {data_dir} gefunden!", file=sys.stderr)
         sys.exit(1)
     
-    print(f"🔍 Lade Sentence-Transformer...")
-    embedder = SentenceTransformer("all-MiniLM-L6-v2")
-    
     print(f"📄 Verarbeite {len(md_files)} Markdown-Dateien...")
     texts = []
+    seen_ids = set()
     for md in md_files:
         print(f"  - {md.name}")
         chunk = md.read_text().split("\n\n")  # einfache Chunks
         for part in chunk:
             if part.strip():  # Leere Chunks überspringen
-                texts.append({"text": part, "meta": str(md)})
-    
-    print(f"🔢 Erstelle Embeddings für {len(texts)} Textabschnitte...")
-    embeddings = embedder.encode([t["text"] for t in texts])
-    
-    print(f"📊 Erstelle FAISS-Index...")
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
+                digest, cid = chunk_id(str(md), part)
+                if cid in seen_ids:  # Identische Abschnitte nur einmal indizieren
+                    continue
+                seen_ids.add(cid)
+                texts.append({"id": cid, "hash": digest, "text": part, "meta": str(md)})
     
     # Speicherung
     index_path = data_dir / "company.index"
     texts_path = data_dir / "company_texts.json"
+    meta_path = data_dir / "company_index_meta.json"
+    cache_path = data_dir / "embedding_cache.npz"
+    bm25_path = data_dir / "company_bm25.json"
     
-    print(f"💾 Speichere Index in {index_path}...")
-    faiss.write_index(index, str(index_path))
+    # Nur neue oder geänderte Abschnitte werden eingebettet
+    cached = load_embedding_cache(cache_path)
+    missing = [t for t in texts if t["id"] not in cached]
+    print(f"🔢 {len(texts) - len(missing)} Embeddings aus dem Cache, {len(missing)} neu zu berechnen...")
+    if missing:
+        print(f"🔍 Lade Sentence-Transformer...")
+        embedder = SentenceTransformer("all-MiniLM-L6-v2")
+        new_embeddings = np.asarray(embedder.encode([t["text"] for t in missing]), dtype=np.float32)
+        cached.update(zip((t["id"] for t in missing), new_embeddings))
+    
+    ids = np.asarray([t["id"] for t in texts], dtype=np.int64)
+    embeddings = np.stack([cached[t["id"]] for t in texts]).astype(np.float32)
+    
+    # Abgleich mit dem bisherigen Stand
+    previous_ids = set()
+    if texts_path.exists():
+        with open(texts_path, "r", encoding="utf-8") as f:
+            previous_ids = {t["id"] for t in json.load(f) if "id" in t}
+    added_ids = [cid for cid in ids.tolist() if cid not in previous_ids]
+    removed_ids = list(previous_ids - set(ids.tolist()))
+    print(f"🧮 {len(added_ids)} neue/geänderte, {len(removed_ids)} entfernte Textabschnitte")
+    
+    index = load_existing_index(index_path, meta_path, embeddings.shape[1])
+    if index is not None and index.ntotal == len(previous_ids):
+        if not added_ids and not removed_ids and bm25_path.exists():
+            print("✅ Index ist aktuell, nichts zu tun.")
+            return
+        print(f"📊 Aktualisiere FAISS-Index ({INDEX_TYPE}) inkrementell...")
+        if removed_ids:
+            index.remove_ids(np.asarray(removed_ids, dtype=np.int64))
+        if added_ids:
+            positions = [i for i, cid in enumerate(ids.tolist()) if cid not in previous_ids]
+            index.add_with_ids(embeddings[positions], ids[positions])
+        index_type = INDEX_TYPE
+    else:
+        print(f"📊 Erstelle FAISS-Index ({INDEX_TYPE})...")
+        index, index_type = build_faiss_index(embeddings, ids, INDEX_TYPE)
+    search_params = tune_search_params(index, index_type, embeddings, ids)
+    
+    print(f"💾 Speichere Embedding-Cache in {cache_path}...")
+    save_embedding_cache(cache_path, ids.tolist(), embeddings)
     
     print(f"💾 Speichere Texte in {texts_path}...")
-    with open(texts_path, "w", encoding="utf-8") as f:
-        json.dump(texts, f, ensure_ascii=False, indent=2)
+    def write_texts(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(texts, f, ensure_ascii=False, indent=2)
+    write_atomic(texts_path, write_texts)
+    
+    # BM25 ist in Sekundenbruchteilen aufgebaut und wird daher immer vollständig neu erstellt
+    print(f"💾 Speichere BM25-Index in {bm25_path}...")
+    bm25 = build_bm25(texts)
+    def write_bm25(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(bm25, f, ensure_ascii=False)
+    write_atomic(bm25_path, write_bm25)
+    
+    print(f"💾 Speichere Index-Parameter in {meta_path}...")
+    def write_meta(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "type": index_type,
+                "dimension": int(embeddings.shape[1]),
+                "count": len(texts),
+                "id_mapped": True,
+                "search_params": search_params
+            }, f, indent=2)
+    write_atomic(meta_path, write_meta)
+    
+    # Der Index wird zuletzt ersetzt, seine Änderungszeit markiert einen neuen Stand
+    print(f"💾 Speichere Index in {index_path}...")
+    write_atomic(index_path, lambda path: faiss.write_index(index, str(path)))
     
     print(f"✅ Index-Erstellung abgeschlossen! {len(texts)} Textabschnitte indiziert.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
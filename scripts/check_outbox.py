@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Prüft die E-Mail-Outbox gegen einen lokalen SMTP-Server (aiosmtpd).
+
+Startet einen aiosmtpd-Controller, legt eine Nachricht in eine temporäre Outbox und
+wartet auf die Zustellung. Danach wird der Server gestoppt: eine zweite Nachricht muss
+in der Outbox bleiben und mit Backoff erneut versucht werden; nach dem Neustart des
+Servers wird sie zugestellt.
+
+    pip install aiosmtpd
+    python scripts/check_outbox.py
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class CollectingHandler:
+    """aiosmtpd-Handler, der empfangene Nachrichten nur sammelt"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise SystemExit(f"FEHLER: Zeitüberschreitung beim Warten auf {what}")
+        time.sleep(0.05)
+
+
+def make_message(subject: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "bot@example.com"
+    msg["To"] = "check@example.com"
+    msg["Subject"] = subject
+    msg.set_content("Outbox-Prüfung")
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeout", type=float, default=15.0, help="Wartezeit pro Schritt in Sekunden")
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        raise SystemExit("aiosmtpd ist nicht installiert: pip install aiosmtpd")
+
+    port = free_port()
+    directory = tempfile.mkdtemp(prefix="outbox-check-")
+    # Die SMTP-Einstellungen liest app.config beim Import
+    os.environ.update({
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(port),
+        "SMTP_STARTTLS": "false",
+        "SMTP_SSL": "false",
+        "SMTP_TIMEOUT": "5",
+        "EMAIL_PASSWORD": "",
+        "OUTBOX_DIR": directory,
+    })
+    sys.path.insert(0, str(ROOT))
+    from app.outbox import EmailOutbox
+
+    outbox = EmailOutbox(directory=directory, max_attempts=10, retry_base=0.5, retry_max=1.0, poll_interval=0.2)
+    handler = CollectingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    outbox.start()
+    try:
+        # 1. Zustellung
+        outbox.enqueue(make_message("check 1"))
+        wait_for(lambda: len(handler.messages) == 1 and outbox.get_stats()["pending"] == 0,
+                 args.timeout, "die Zustellung der ersten Nachricht")
+        print(f"OK: erste Nachricht zugestellt an {handler.messages[0].rcpt_tos}")
+
+        # 2. Server gestoppt: die Nachricht bleibt liegen und wird erneut versucht
+        controller.stop()
+        retries_before = outbox.get_stats()["retries"]
+        outbox.enqueue(make_message("check 2"))
+        wait_for(lambda: outbox.get_stats()["retries"] >= retries_before + 2,
+                 args.timeout, "einen erneuten Versuch bei gestopptem Server")
+        stats = outbox.get_stats()
+        if stats["pending"] != 1 or stats["failed"] != 0:
+            raise SystemExit(f"FEHLER: Nachricht nicht mehr in der Outbox: {stats}")
+        meta_path = next(Path(directory).glob("*.json"))
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        print(f"OK: Versand wiederholt ({meta['attempts']} Versuche, letzter Fehler: {meta['last_error']})")
+
+        # 3. Nach dem Neustart des Servers wird die liegen gebliebene Nachricht zugestellt
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        wait_for(lambda: len(handler.messages) == 2 and outbox.get_stats()["pending"] == 0,
+                 args.timeout, "die Zustellung nach dem Neustart")
+        print("OK: zweite Nachricht nach dem Neustart zugestellt")
+        print(json.dumps(outbox.get_stats(), indent=2, ensure_ascii=False))
+    finally:
+        outbox.stop()
+        try:
+            controller.stop()
+        except (AssertionError, RuntimeError):
+            pass  # Bereits gestoppt
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()